@@ -47,7 +47,7 @@ def run_simulation():
         mf = partial(drug.set_resistance, drug='AM') # (allele=i+1) but GERMLINE wants bi-allelic instead of marking individual emergences with 1,2,3,etc.
         resistant_genome=gn.Genome.from_allele_freq(mod_fns = [mf])
         mutation_fn = lambda s: s.populations['Population #0'].add_infection_from_genomes([resistant_genome])
-        s.add_event(t, mutation_fn)
+        s.add_event(t, mutation_fn, 'Population #0')
 
     s.run()
 
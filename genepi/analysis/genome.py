@@ -20,7 +20,7 @@ except:
     print('Install seaborn package for more pleasing aesthetics.')
     cmap='hsv'
 
-from genepi.genome import bp_per_cM,chrom_names,chrom_lengths_Mbp
+from genepi.genome import bp_per_cM,chrom_names,chrom_lengths_Mbp,ibd_segments
 
 cwd=os.path.dirname(os.path.realpath(__file__))
 
@@ -139,19 +139,39 @@ def cluster_finder(chrom_name=''):
     except OSError:
         print('DASH executable not found at %s'%exe)
 
-def ibd_analysis():
+def tract_ibd(d,sample=100):
+    '''
+    Exact pairwise IBD segments from the ancestry tracts
+    of a GenomeReport of tract genomes, with the columns
+    of GERMLINE output used in ibd_analysis
+    '''
+    chrom_breaks,bin_size=d['chrom_breaks'],d['bin_size']
+    tracts=pd.DataFrame(d['tracts'],columns=['gid','start','end','founder'])
+    by_gid={gid:[tuple(t) for t in g[['start','end','founder']].values]
+            for gid,g in tracts.groupby('gid')}
+    gids=sorted(by_gid)[::sample]
+    rows=[]
+    for i,g1 in enumerate(gids):
+        for g2 in gids[i+1:]:
+            for c,s,e in ibd_segments(by_gid[g1],by_gid[g2],chrom_breaks):
+                start,end=[(b-chrom_breaks[c])*bin_size for b in (s,e)]
+                rows.append(('g%d'%g1,'g%d'%g2,chrom_names[c],start,end,(end-start)/bp_per_cM))
+    return pd.DataFrame(rows,columns=['indId1','indId2','chrom','start','end','dist'])
+
+def ibd_analysis(df=None):
 
     # Concatenate by-chromosome GERMLINE output
-    allFiles = glob.glob('output/germline**.match')
-    df = pd.DataFrame()
-    list = []
-    for file in allFiles:
-        tmp = pd.read_csv(file,delim_whitespace=True,index_col=None,header=None)
-        list.append(tmp)
-    df = pd.concat(list)
-    df.columns=['famId1','indId1','famId2','indId2',
-                'chrom','start','end','startSNP','endSNP',
-                'bits','dist','unit','mismatches','homo1','homo2']
+    if df is None:
+        allFiles = glob.glob('output/germline**.match')
+        df = pd.DataFrame()
+        list = []
+        for file in allFiles:
+            tmp = pd.read_csv(file,delim_whitespace=True,index_col=None,header=None)
+            list.append(tmp)
+        df = pd.concat(list)
+        df.columns=['famId1','indId1','famId2','indId2',
+                    'chrom','start','end','startSNP','endSNP',
+                    'bits','dist','unit','mismatches','homo1','homo2']
 
     # IBD segment lengths
     def plot_IBD_lengths(df):
@@ -265,15 +285,22 @@ def load_npz(file):
         with np.load(file) as data:
             A = data['genomes']
             header=data['header']
+            d={'genomes':A,'header':header}
+            if 'tracts' in data:
+                for k in ('tracts','chrom_breaks','bin_size'):
+                    d[k]=data[k]
     except IOError as e:
         sys.exit(e)
-    return {'genomes':A,'header':header}
+    return d
 
 def genome_analysis(file='simulations/GenomeReport.npz',reformat=True,sample=100):
     '''
     Analysis of the GenomeReport output
     '''
     d=load_npz(file)
+    if 'tracts' in d:
+        ibd_analysis(tract_ibd(d,sample))
+        return
     genomes=pd.DataFrame(d['genomes'],columns=d['header'])
 
     for chrom_name in chrom_names:
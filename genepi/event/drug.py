@@ -1,19 +1,19 @@
-import random
 import logging
 log = logging.getLogger(__name__)
 
 from .. import genome as gn
+from .. import sampling
 from genepi.report.listener import Listener
 from genepi.infection import Transmission
 
 resistant_sites = {'AM': (13, 1886271)}
 
 def is_resistant(g, drug):
-    resistant_idx = gn.snp_bin_from_chrom_pos(*resistant_sites[drug])
-    return g[resistant_idx]
+    resistant_bin = gn.snp_bin_from_chrom_pos(*resistant_sites[drug])
+    return g.barcode(sites=[resistant_bin])[0]
 
 def set_resistance(g, drug, allele=1):
-    resistant_idx = gn.snp_bin_from_chrom_pos(*resistant_sites[drug])
+    resistant_idx = gn.site_from_bin(gn.snp_bin_from_chrom_pos(*resistant_sites[drug]))
     log.debug('Setting %s resistance at index %d', drug, resistant_idx)
     g[resistant_idx] = allele
 
@@ -39,14 +39,14 @@ class DrugTreatment(Listener):
             raise Exception('Expected list of Transmission objects as first argument.')
 
         popId = transmission[0].populationId
-        treatment = self.treatment_by_population(self.parent.day).get(popId,None)
+        treatment = self.treatment_by_population(transmission[0].day).get(popId,None)
 
-        if not treatment or random.random() > treatment['fraction']:
+        if not treatment or sampling.random_sample() > treatment['fraction']:
             return
 
         infection = transmission[0].infection
         for i,g in enumerate(infection.genomes):
-            infection.genomes = [g for g in infection.genomes if random.random() > treatment['clearance'](g.genome)]
+            infection.set_genomes([g for g in infection.genomes if sampling.random_sample() > treatment['clearance'](g)])
             if not infection.genomes:
                 log.debug('New infection cleared with prompt treatment.')
-                infection.infection_timer = 0
+                infection.expire()
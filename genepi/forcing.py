@@ -0,0 +1,68 @@
+import os
+
+import logging
+log = logging.getLogger(__name__)
+
+import numpy as np
+
+class Forcing:
+    '''
+    Vectorial capacity by day, looked up from a table
+    tabulated from a function of day up to the latest day looked up,
+    or loaded from a forcing file, e.g. the output of an entomological model
+    '''
+
+    def __init__(self,values=[],fn=None):
+        self.values=np.asarray(values,dtype=float) # with room for more days of fn
+        self.n_days=len(self.values)
+        self.fn=fn
+
+    @classmethod
+    def from_function(cls,fn):
+        return cls(fn=fn)
+
+    @classmethod
+    def from_file(cls,filename):
+        '''
+        Daily values from a .npy array, or from a .csv file
+        of one value per day or of (day,value) rows,
+        interpolated between the given days
+        '''
+        log.info('Reading vectorial capacity forcing from file: %s',filename)
+        if os.path.splitext(filename)[1]=='.npy':
+            data=np.load(filename)
+            data=data.reshape(len(data),-1)
+        else:
+            with open(filename) as f:
+                n_columns=len(f.readline().split(','))
+            data=np.genfromtxt(filename,delimiter=',').reshape(-1,n_columns)
+            data=data[~np.isnan(data).any(axis=1)]
+        if data.shape[1]==1:
+            return cls(data[:,0])
+        if data.shape[1]!=2:
+            raise Exception('Forcing file %s is not one value or (day,value) per row.'%filename)
+        days,values=data[:,0],data[:,1]
+        return cls(np.interp(np.arange(days.max()+1),days,values))
+
+    def __len__(self):
+        return self.n_days
+
+    def tabulate(self,day):
+        '''
+        Tabulate fn up to day, growing the table geometrically
+        '''
+        start=len(self)
+        if day<start:
+            return
+        if day>=len(self.values):
+            self.values=np.resize(self.values,max(day+1,2*len(self.values)))
+        self.values[start:day+1]=[self.fn(t) for t in range(start,day+1)]
+        self.n_days=day+1
+
+    def __call__(self,t):
+        day=int(t)
+        if day>=len(self):
+            if self.fn is None:
+                raise Exception('Cannot extrapolate forcing of %d days to day %d.'%(len(self),day))
+            self.tabulate(day)
+        return self.values[day]
@@ -1,6 +1,5 @@
 import math
 import bisect
-import random
 import itertools
 from collections import defaultdict
 import hashlib
@@ -12,13 +11,17 @@ log = logging.getLogger(__name__)
 import numpy as np # for fast meiosis operations on arrays
 
 import utils
+import sampling
 from snp.snp import SNP
+from store import GenomeStore
 from transmission import Transmission
 
 bp_per_morgan = 1.5e6
 bp_per_cM     = bp_per_morgan/1e2
 bp_per_Mbp    = 1e6
 
+meiosis_batch_bytes = 2**20 # crossover-mask array size per vectorized meiosis chunk
+
 mutation_prob = 9.7e-9 / 2.0  # (per day, per position) Bopp et al, 2013. Mitotic Evolution of Plasmodium falciparum Shows a Stable Core Genome but Recombination in Antigen Families.
 
 chrom_names       = range(1,15) # + ['MT','Api']
@@ -28,11 +31,13 @@ chrom_lengths_bp  = [ int(bp_per_Mbp*c) for c in chrom_lengths_Mbp ]
 Pf_chrom_lengths  = dict(zip(chrom_names,chrom_lengths_bp))
 log.debug('Chromosome lengths:\n%s',Pf_chrom_lengths)
 
-def initialize_from(SNP_source,bin_size=None,min_allele_freq=0):
+def initialize_from(SNP_source,bin_size=None,min_allele_freq=0,
+                    barcode_only=False,packed=False,interned=False,tracts=False):
     SNPs=SNP.initialize_from(SNP_source,min_allele_freq)
     set_bin_size(SNPs,bin_size)
     set_chrom_breaks()
     set_binned_SNPs(SNPs)
+    set_sites(barcode_only,packed,interned,tracts)
 
 def set_bin_size(SNPs,bin_size):
     if bin_size:
@@ -111,9 +116,174 @@ def add_locus(chrom,pos,name,fitness,freq=0):
         Genome.SNP_names.append(name)
         Genome.SNP_freqs.append(freq)
     Genome.bin_fitness[add_bin] = fitness
+    set_sites(Genome.barcode_only,Genome.packed,Genome.interned,Genome.tracts)
+
+def set_sites(barcode_only=False,packed=False,interned=False,tracts=False):
+    '''
+    Genome bins stored in Genome.genome: every bin of the genome,
+    or only the binned SNPs in the barcode-only representation,
+    which must then be initialized after any call to add_locus.
+    Packed genomes store biallelic sites 64 per uint64 word.
+    Interned genomes are tuples of chromosome ids into Genome.store,
+    each distinct chromosome being stored once.
+    Tract genomes are tuples of (start_bin,end_bin,founder_id) ancestry
+    tracts, with alleles resolved from founders in Genome.store.
+    '''
+    if packed and interned:
+        raise Exception('Packed genomes cannot be interned by chromosome.')
+    if tracts and (packed or interned):
+        raise Exception('Tract genomes cannot also be packed or interned.')
+    Genome.barcode_only=barcode_only
+    Genome.packed=packed
+    Genome.interned=interned
+    Genome.tracts=tracts
+    if barcode_only:
+        Genome.site_bins=np.unique(Genome.SNP_bins)
+    else:
+        Genome.site_bins=np.arange(genome_length())
+    Genome.chrom_site_breaks=list(np.searchsorted(Genome.site_bins,Genome.chrom_breaks))
+    Genome.SNP_sites=np.searchsorted(Genome.site_bins,Genome.SNP_bins)
+    Genome.fitness_bins=np.flatnonzero(Genome.bin_fitness!=1)
+    Genome.fitness_sites=np.searchsorted(Genome.site_bins,Genome.fitness_bins)
+    Genome.fitness_values=Genome.bin_fitness[Genome.fitness_bins]
+    Genome.fitness_version+=1
+    Genome.store.clear_fitness()
+    if packed:
+        chrom_sites=np.zeros((num_chroms(),n_sites()),dtype=bool)
+        for c,(start,end) in enumerate(utils.pairwise(Genome.chrom_site_breaks)):
+            chrom_sites[c,start:end]=True
+        Genome.chrom_site_words=pack_alleles(chrom_sites)
+    log.debug('%d genome sites per genome of %d bins',n_sites(),genome_length())
+
+def site_from_bin(b):
+    idx=np.searchsorted(Genome.site_bins,b)
+    if idx==n_sites() or Genome.site_bins[idx]!=b:
+        raise IndexError('No genome site at bin %d in barcode-only genome.' % b)
+    return idx
+
+def site_fitness():
+    if Genome.barcode_only:
+        return Genome.bin_fitness[Genome.site_bins]
+    return Genome.bin_fitness
 
 def reference_genome():
-    return np.zeros(genome_length(),dtype=np.uint8)
+    return np.zeros(n_sites(),dtype=np.uint8)
+
+def split_chromosomes(alleles):
+    return [alleles[start:end] for start,end in utils.pairwise(Genome.chrom_site_breaks)]
+
+def chromosome_digests(chromosomes):
+    return tuple(hashlib.sha1(c).digest() for c in chromosomes)
+
+def chromosome_site_alleles(chromosomes,site_idxs):
+    site_idxs=np.asarray(site_idxs)
+    if not site_idxs.size:
+        return np.zeros(0,dtype=np.uint8)
+    breaks=np.asarray(Genome.chrom_site_breaks)
+    chrom_idxs=np.searchsorted(breaks,site_idxs,side='right')-1
+    alleles=np.empty(len(site_idxs),dtype=np.uint8)
+    for c in np.unique(chrom_idxs):
+        sel=(chrom_idxs==c)
+        alleles[sel]=chromosomes[c][site_idxs[sel]-breaks[c]]
+    return alleles
+
+def founder_tracts(alleles):
+    sites=np.flatnonzero(alleles)
+    founder=Genome.store.founders.intern(Genome.site_bins[sites],alleles[sites])
+    return ((0,genome_length(),founder),)
+
+def tract_alleles(tracts,bins):
+    '''
+    Alleles at genome bins, from the founders of the tracts covering them
+    '''
+    bins=np.asarray(bins)
+    if not bins.size:
+        return np.zeros(0,dtype=np.uint8)
+    starts=[t[0] for t in tracts]
+    founders=np.array([t[2] for t in tracts])[np.searchsorted(starts,bins,side='right')-1]
+    alleles=np.zeros(len(bins),dtype=np.uint8)
+    for f in np.unique(founders):
+        sel=(founders==f)
+        alleles[sel]=Genome.store.founders.alleles(f,bins[sel])
+    return alleles
+
+def tract_variants(tracts):
+    '''
+    Genome bins and alleles of the non-reference alleles in the tracts
+    '''
+    variants=[Genome.store.founders.variants_between(f,start,end) for start,end,f in tracts]
+    return tuple(np.concatenate(v) for v in zip(*variants))
+
+def splice_tracts(parents,segments):
+    '''
+    Tracts of the parents[p] genome between each (start,end,p)
+    of the sorted segments, merging adjacent tracts of one founder
+    '''
+    parent_starts=[[t[0] for t in tracts] for tracts in parents]
+    spliced=[]
+    for start,end,p in segments:
+        if start>=end:
+            continue
+        tracts=parents[p]
+        idx=bisect.bisect_right(parent_starts[p],start)-1
+        while idx<len(tracts) and tracts[idx][0]<end:
+            s,e,f=tracts[idx]
+            s,e=max(s,start),min(e,end)
+            if spliced and spliced[-1][2]==f and spliced[-1][1]==s:
+                spliced[-1]=(spliced[-1][0],e,f)
+            else:
+                spliced.append((s,e,f))
+            idx+=1
+    return tuple(spliced)
+
+def ibd_segments(tracts1,tracts2,chrom_breaks=None):
+    '''
+    Exact identity-by-descent: the (chrom_idx,start_bin,end_bin) segments
+    of each chromosome where two tract genomes share a founder
+    '''
+    chrom_breaks=Genome.chrom_breaks if chrom_breaks is None else list(chrom_breaks)
+    shared=[]
+    i,j=0,0
+    while i<len(tracts1) and j<len(tracts2):
+        s1,e1,f1=tracts1[i]
+        s2,e2,f2=tracts2[j]
+        s,e=max(s1,s2),min(e1,e2)
+        if f1==f2 and s<e:
+            if shared and shared[-1][1]==s:
+                shared[-1]=(shared[-1][0],e)
+            else:
+                shared.append((s,e))
+        if e1<=e2:
+            i+=1
+        if e2<=e1:
+            j+=1
+    segments=[]
+    for s,e in shared:
+        c=bisect.bisect_right(chrom_breaks,s)-1
+        while s<e:
+            end=min(e,chrom_breaks[c+1])
+            segments.append((c,s,end))
+            s,c=end,c+1
+    return segments
+
+def n_words():
+    return -(-n_sites()//64)
+
+def pack_alleles(alleles):
+    '''
+    Biallelic site alleles (any non-zero allele packs to 1)
+    as zero-padded uint64 words along the last axis
+    '''
+    packed=np.packbits(alleles,axis=-1)
+    padding=np.zeros(packed.shape[:-1]+(8*n_words()-packed.shape[-1],),dtype=np.uint8)
+    return np.concatenate([packed,padding],axis=-1).view(np.uint64)
+
+def unpack_alleles(words):
+    return np.unpackbits(words.view(np.uint8),axis=-1)[...,:n_sites()]
+
+def packed_alleles(words,site_idxs):
+    site_idxs=np.asarray(site_idxs)
+    return (words.view(np.uint8)[site_idxs>>3]>>(7-(site_idxs&7)))&1
 
 def num_SNPs():
     return len(Genome.SNP_bins)
@@ -121,6 +291,12 @@ def num_SNPs():
 def genome_length():
     return Genome.chrom_breaks[-1]
 
+def n_sites():
+    return len(Genome.site_bins)
+
+def num_chroms():
+    return len(Genome.chrom_breaks)-1
+
 def display_bit(b):
     return '*' if b else '-'
 
@@ -130,14 +306,11 @@ def get_crossover_points(chrom_length,bp_per_morgan=bp_per_morgan):
     while next_point < chrom_length:
         if next_point:
             xpoints.append(next_point)
-        d = int(math.ceil(random.expovariate(Genome.bin_size_bp/bp_per_morgan)))
+        d = int(math.ceil(sampling.exponential(bp_per_morgan/Genome.bin_size_bp)))
         next_point+=d
     #log.debug('Chr %s recomb: %s', chrom, xpoints)
     return xpoints
 
-# TODO: further optimization of crossover/meiosis as
-#       size=(4,genome_length) matrix operations
-
 def crossover(c1,c2,xpoints):
     c3=np.copy(c1)
     c4=np.copy(c2)
@@ -149,54 +322,223 @@ def crossover(c1,c2,xpoints):
         c4[l1:l2] = t
     return c3,c4
 
-def meiosis(in1,in2,N=4):
-    if N > 4:
+def batch_crossover_points(n_meioses,bp_per_morgan=bp_per_morgan):
+    '''
+    Crossover points for all chromosomes of a batch of meioses,
+    as a ragged array: the sorted genome bins of chromosome c
+    of meiosis m are xbins[offsets[i]:offsets[i+1]] for i=m*num_chroms()+c.
+    Equivalent to get_crossover_points, as a Poisson number of
+    crossovers on bins 1 to chrom_length-1 of each chromosome
+    at uniformly distributed positions.
+    '''
+    starts=np.asarray(Genome.chrom_breaks[:-1])
+    lengths=np.diff(Genome.chrom_breaks)
+    rate=Genome.bin_size_bp/bp_per_morgan
+    counts=sampling.poisson(np.tile(rate*(lengths-1),(n_meioses,1))).ravel()
+    chrom_idxs=np.repeat(np.tile(np.arange(num_chroms()),n_meioses),counts)
+    positions=1+(sampling.random_sample(len(chrom_idxs))*(lengths[chrom_idxs]-1)).astype(np.intp)
+    # sort positions within each chromosome by sorting
+    # on (meiosis,bin) as all chromosomes are in genome order
+    meiosis_idxs=np.repeat(np.arange(n_meioses),counts.reshape(n_meioses,-1).sum(axis=1))
+    keys=meiosis_idxs*genome_length()+starts[chrom_idxs]+positions
+    keys.sort()
+    offsets=np.concatenate([[0],np.cumsum(counts)])
+    return offsets,keys%genome_length()
+
+def crossover_counts(n_meioses,offsets):
+    return np.diff(offsets).reshape(n_meioses,num_chroms())
+
+def crossover_masks(n_meioses,offsets,xbins):
+    '''
+    Cumulative-parity masks of shape (n_meioses,n_sites):
+    True where the first recombinant chromatid (c3 in crossover)
+    carries the second parent's allele.
+    Crossovers in genome bins are mapped to the first genome site
+    at or beyond them.
+    '''
+    L=n_sites()
+    breaks=np.asarray(Genome.chrom_site_breaks)
+    xsites=np.searchsorted(Genome.site_bins,xbins)
+    # close swaps left open by an odd number of crossovers on a chromosome
+    # so that parity resets at the start of the next chromosome
+    n_xpoints=crossover_counts(n_meioses,offsets)
+    meiosis_idxs=np.repeat(np.arange(n_meioses),n_xpoints.sum(axis=1))
+    odd_m,odd_c=np.nonzero(n_xpoints%2)
+    toggles=np.concatenate([meiosis_idxs*L+xsites,odd_m*L+breaks[odd_c+1]])
+    toggles.sort()
+    M=np.zeros((n_meioses,L),dtype=bool)
+    flat=M.reshape(-1)
+    for l1,l2 in toggles.reshape(-1,2):
+        flat[l1:l2]=True
+    return M
+
+def chromatid_assignments(n_meioses):
+    '''
+    Independent assortment: a random permutation of the four chromatids
+    (parent 1, parent 2, and the two recombinants) for every chromosome
+    '''
+    rands=sampling.random_sample((n_meioses,num_chroms(),4))
+    return np.argsort(rands,axis=2)
+
+def batch_meiosis(gametocyte_pairs,n_products):
+    '''
+    Meiotic products for a batch of gametocyte pairs: a list of
+    n_products[i] distinct-chromatid Genomes for each pair.
+    Crossover masks and chromatid assignments are drawn for chunks of
+    pairs at once, with (n_pairs,n_sites) masks no bigger than
+    meiosis_batch_bytes.
+    '''
+    if max(n_products) > 4:
         raise IndexError('Maximum of four distinct meiotic products to sample.')
-    genomes=[reference_genome() for _ in range(4)]
-    for idx,(start,end) in enumerate(utils.pairwise(Genome.chrom_breaks)):
-        c1,c2=in1.genome[start:end],in2.genome[start:end]
-        xpoints=get_crossover_points(chrom_length=len(c1))
-        #log.debug('Chr %d, xpoints=%s',chrom_names[idx],xpoints)
-        c3,c4=crossover(c1,c2,xpoints)
-        outputs=sorted([c1,c2,c3,c4], key=lambda *args: random.random())
-        for j in range(4):
-            genomes[j][start:end]=outputs[j]
-    return [Genome(genomes[j]) for j in range(N)]
+    chunk=max(1,meiosis_batch_bytes//n_sites())
+    products=[]
+    for i in range(0,len(gametocyte_pairs),chunk):
+        products.extend(chromatid_products(gametocyte_pairs[i:i+chunk],
+                                           n_products[i:i+chunk]))
+    return products
+
+def chromatid_products(gametocyte_pairs,n_products):
+    n=len(gametocyte_pairs)
+    offsets,xbins=batch_crossover_points(n)
+    assignments=chromatid_assignments(n)
+    if Genome.tracts:
+        return tract_chromatid_products(gametocyte_pairs,n_products,offsets,xbins,assignments)
+    M=crossover_masks(n,offsets,xbins)
+    if Genome.packed:
+        return packed_chromatid_products(gametocyte_pairs,n_products,M,assignments)
+    crossed=crossover_counts(n,offsets)>0
+    if Genome.interned:
+        return interned_chromatid_products(gametocyte_pairs,n_products,M,crossed,assignments)
+    M=M.view(np.uint8)
+    chrom_slices=[slice(start,end) for start,end in utils.pairwise(Genome.chrom_site_breaks)]
+    products=[]
+    for i,((g1,g2),N) in enumerate(zip(gametocyte_pairs,n_products)):
+        # chromatids are (P1, P2, where(M,P2,P1), where(M,P1,P2)),
+        # where the recombinants are each parent XOR the swapped alleles
+        parents=(g1.chromosome_alleles(),g2.chromosome_alleles())
+        digests=(g1.chrom_digests,g2.chrom_digests)
+        swapped={}
+        genomes=[]
+        for j in range(N):
+            chromatids,chrom_digests=[],[]
+            for c,(k,s) in enumerate(zip(assignments[i,:,j],chrom_slices)):
+                if k<2 or not crossed[i,c] or digests[0][c]==digests[1][c]:
+                    chromatids.append(parents[k%2][c])
+                    chrom_digests.append(digests[k%2][c])
+                else:
+                    if c not in swapped:
+                        swapped[c]=(parents[0][c]^parents[1][c])*M[i,s]
+                    chromatids.append(parents[k-2][c]^swapped[c])
+                    chrom_digests.append(hashlib.sha1(chromatids[-1]).digest())
+            genomes.append(Genome(tuple(chromatids),chrom_digests=tuple(chrom_digests)))
+        products.append(genomes)
+    return products
+
+def packed_chromatid_products(gametocyte_pairs,n_products,M,assignments):
+    '''
+    Chromatid k of every chromosome is P1^(D&S) for D=P1^P2 and
+    S=(M&recombinant)^odd, with per-chromosome recombinant (k>=2) and
+    odd (k in {1,3}) word masks, so no slicing at chromosome boundaries.
+    '''
+    M=pack_alleles(M)
+    or_reduce=np.bitwise_or.reduce
+    products=[]
+    for i,((g1,g2),N) in enumerate(zip(gametocyte_pairs,n_products)):
+        D=g1.genome^g2.genome
+        genomes=[]
+        for j in range(N):
+            k=assignments[i,:,j]
+            recombinant=or_reduce(Genome.chrom_site_words[k>=2],axis=0)
+            odd=or_reduce(Genome.chrom_site_words[k%2==1],axis=0)
+            genomes.append(Genome(g1.genome^(D&((M[i]&recombinant)^odd))))
+        products.append(genomes)
+    return products
+
+def interned_chromatid_products(gametocyte_pairs,n_products,M,crossed,assignments):
+    '''
+    Parental chromatids keep the parent's chromosome id, as do the
+    recombinants of chromosomes without crossovers or with identical
+    parental chromosomes. Only the remaining recombinant chromosomes
+    are materialized and interned.
+    '''
+    intern=Genome.store.chromosomes.intern
+    chrom_slices=[slice(start,end) for start,end in utils.pairwise(Genome.chrom_site_breaks)]
+    M=M.view(np.uint8)
+    products=[]
+    for i,((g1,g2),N) in enumerate(zip(gametocyte_pairs,n_products)):
+        genomes=[]
+        for j in range(N):
+            chrom_ids=[]
+            for c,(k,s) in enumerate(zip(assignments[i,:,j],chrom_slices)):
+                ids=(g1.genome[c],g2.genome[c])
+                if k<2 or not crossed[i,c] or ids[0]==ids[1]:
+                    chrom_ids.append(ids[k%2])
+                else:
+                    parents=(g1.chromosomes[c],g2.chromosomes[c])
+                    chrom_ids.append(intern(parents[k-2]^((parents[0]^parents[1])*M[i,s])))
+            genomes.append(Genome(tuple(chrom_ids)))
+        products.append(genomes)
+    return products
+
+def tract_chromatid_products(gametocyte_pairs,n_products,offsets,xbins,assignments):
+    '''
+    Chromatids of tract genomes are spliced from the parental tracts
+    between chromosome breaks and crossover points, so that the cost
+    scales with the number of tracts and crossovers, not genome length.
+    '''
+    C=num_chroms()
+    breaks=Genome.chrom_breaks
+    offsets=offsets.tolist()
+    xbins=xbins.tolist()
+    products=[]
+    for i,((g1,g2),N) in enumerate(zip(gametocyte_pairs,n_products)):
+        chrom_points=[[breaks[c]]+xbins[offsets[i*C+c]:offsets[i*C+c+1]]+[breaks[c+1]]
+                      for c in range(C)]
+        genomes=[]
+        for j in range(N):
+            segments=[]
+            for k,points in zip(assignments[i,:,j],chrom_points):
+                if k<2:
+                    segments.append((points[0],points[-1],k))
+                else:
+                    # recombinant k starts with parent k-2, alternating at crossovers
+                    segments.extend((s,e,(k-2+m)%2) for m,(s,e) in enumerate(utils.pairwise(points)))
+            genomes.append(Genome(splice_tracts((g1.genome,g2.genome),segments)))
+        products.append(genomes)
+    return products
+
+def meiosis(in1,in2,N=4):
+    return batch_meiosis([(in1,in2)],[N])[0]
 
 def single_meiotic_product(in1,in2):
-    out_genome=reference_genome()
-    for idx,(start,end) in enumerate(utils.pairwise(Genome.chrom_breaks)):
-        R=random.random()
-        if R<0.25:
-            out_genome[start:end]=in1.genome[start:end]
-        elif R<0.5:
-            out_genome[start:end]=in2.genome[start:end]
-        else:
-            xpoints=get_crossover_points(chrom_length=(end-start))
-            #log.debug('Chr %d, xpoints=%s',chrom_names[idx],xpoints)
-            c3,c4=crossover(in1.genome[start:end],in2.genome[start:end],xpoints)
-            out_genome[start:end]=c3 if R<0.75 else c4
-    return Genome(out_genome)
-
-def distinct_sporozoites_from(gametocyte_pairs,n_products):
-    transmitted_sporozoites=[]
-    for (g1,g2),N in zip(gametocyte_pairs,n_products):
+    return batch_meiosis([(in1,in2)],[1])[0][0]
+
+def distinct_sporozoites_from(gametocyte_pairs,n_products,offsets=None):
+    '''
+    Distinct sporozoite Transmissions from the meiotic products of
+    the gametocyte pairs or, given offsets, a list of those from each
+    slice of pairs between them, all from a single batch of meioses
+    '''
+    transmitted_sporozoites=[[] for _ in gametocyte_pairs]
+    meiosis_idxs=[]
+    for idx,(g1,g2) in enumerate(gametocyte_pairs):
         if g1.id==g2.id:
             #log.debug('Selfing of gametocytes (id=%d)\n%s',g1.id,g1)
-            t=Transmission((g1.id,g2.id),g1)
-            transmitted_sporozoites.append(t)
-            continue
-        if N>1:
-            meiotic_products=meiosis(g1,g2,N)
-            #log.debug('Meiosis: %s',[str(mp) for mp in meiotic_products])
-            tt=[Transmission((g1.id,g2.id),g) for g in meiotic_products]
-            transmitted_sporozoites.extend(tt)
+            transmitted_sporozoites[idx].append(Transmission((g1.id,g2.id),g1))
         else:
-            selected_product=single_meiotic_product(g1,g2)
-            #log.debug('Single meiotic product: %s',selected_product)
-            t=Transmission((g1.id,g2.id),selected_product)
-            transmitted_sporozoites.append(t)
-    return distinct(transmitted_sporozoites,id_fn=lambda t:t.genome.id)
+            meiosis_idxs.append(idx)
+    if meiosis_idxs:
+        meiotic_products=batch_meiosis([gametocyte_pairs[i] for i in meiosis_idxs],
+                                       [n_products[i] for i in meiosis_idxs])
+        for idx,products in zip(meiosis_idxs,meiotic_products):
+            #log.debug('Meiosis: %s',[str(mp) for mp in products])
+            g1,g2=gametocyte_pairs[idx]
+            transmitted_sporozoites[idx]=[Transmission((g1.id,g2.id),g) for g in products]
+    id_fn=lambda t:t.genome.id
+    if offsets is None:
+        return distinct(itertools.chain(*transmitted_sporozoites),id_fn)
+    return [distinct(itertools.chain(*transmitted_sporozoites[start:end]),id_fn)
+            for start,end in utils.pairwise(offsets)]
 
 
 def distinct(genomes,
@@ -211,21 +553,51 @@ def distinct(genomes,
             distinct.append(g)
     return distinct
 
+def distinct_alleles(alleles):
+    '''
+    Distinct rows of a 2D allele array, in order of first occurrence,
+    and the index into those of each row, deduplicating many genome
+    arrays at once through a single np.unique over a void view of the rows
+    '''
+    alleles=np.ascontiguousarray(alleles)
+    rows=alleles.view(np.dtype((np.void,alleles.dtype.itemsize*alleles.shape[1]))).ravel()
+    _,first,inverse=np.unique(rows,return_index=True,return_inverse=True)
+    order=np.argsort(first)
+    rank=np.empty_like(order)
+    rank[order]=np.arange(len(order))
+    return alleles[first[order]],rank[inverse]
+
 class Genome:
     '''
     The discretized representation of SNPs on chromosomes
     '''
 
     id=itertools.count()
-    hash_to_id   = {}
+    store=GenomeStore()
 
     chrom_idxs    = {} # chrom_break indices by chromosome name
     chrom_breaks  = [] # locations of chromosome breakpoints on genome
+    barcode_only  = False # store only SNP sites instead of every bin
+    site_bins     = [] # genome bins of the stored sites
+    chrom_site_breaks = [] # locations of chromosome breakpoints on sites
     SNP_bins      = [] # locations of variable positions on genome
+    SNP_sites     = [] # site indices of binned SNPs
+    fitness_bins  = [] # genome bins of non-neutral fitness
+    fitness_sites = [] # site indices of fitness_bins
+    fitness_values = [] # bin_fitness at fitness_bins
+    fitness_version = 0 # incremented whenever bin_fitness may have changed
+    fitness_cache = (-1,1.) # (fitness_version,fitness) of a genome
     SNP_names     = [] # chrom.pos encoding of binned SNPs
     SNP_freqs     = [] # minor-allele frequency of binned SNPs
     bin_fitness   = [] # relative fitness at each binned site
     bin_size_bp   = [] # base pairs per genome bin
+    packed        = False # store biallelic sites as bits of uint64 words
+    chrom_site_words = [] # packed mask of each chromosome's sites
+    interned      = False # store genomes as tuples of interned chromosome ids
+    chromosomes   = None  # chromosome allele arrays of an interned genome
+    chrom_digests = None  # per-chromosome SHA-1 digests of an unpacked genome array
+    chromatids    = None  # per-chromosome alleles of a lazy genome, until built
+    tracts        = False # store genomes as founder ancestry tracts
 
     # TODO: find a better thread-safe way of letting Genome know what
     #       Simulation to notify on reportable events
@@ -234,23 +606,63 @@ class Genome:
     def set_simulation_ref(cls,sim):
         cls.sim=sim
 
-    def __init__(self,genome,mod_fns=[]):
-        self.genome=genome
+    def __init__(self,genome,mod_fns=[],chrom_digests=None,id=None):
+        '''
+        A genome from an array of site alleles or, if interned,
+        from a tuple of chromosome ids already in Genome.store,
+        or from a tuple of ancestry tracts for tract genomes.
+        An array of site alleles makes a new tract genome founder.
+        Otherwise, a tuple of per-chromosome alleles makes a lazy genome
+        that concatenates them into Genome.genome only on first use.
+        The chromosome digests of an unpacked genome are computed
+        unless given, e.g. as inherited by meiotic products.
+        A genome given an id, e.g. received from another process,
+        keeps it if not already stored and is not reported again.
+        '''
         for fn in mod_fns:
-            fn(self.genome)
-        h=hash(self)
-        id=Genome.hash_to_id.get(h,None)
-        #id=None
-        if id:
+            fn(genome)
+        if Genome.packed and genome.dtype!=np.uint64:
+            genome=pack_alleles(genome)
+        if Genome.interned:
+            if not isinstance(genome,tuple):
+                intern=Genome.store.chromosomes.intern
+                genome=tuple(intern(c) for c in split_chromosomes(genome))
+            self.chromosomes=Genome.store.chromosomes.get(genome)
+        elif Genome.tracts and not isinstance(genome,tuple):
+            genome=founder_tracts(genome)
+        elif not (Genome.packed or Genome.tracts):
+            if isinstance(genome,tuple):
+                self.chromatids=genome
+            self.chrom_digests=chrom_digests or chromosome_digests(self.chromosome_alleles(genome))
+        if self.chromatids is None:
+            self.genome=genome
+        h=self.key()
+        stored=Genome.store.get(h,self)
+        if stored is not None:
+            self.id=stored.id
+            self.share_alleles(stored)
+            self.fitness_cache=stored.fitness_cache
+        elif id is not None:
             self.id=id
+            Genome.store.add(h,self)
         else:
             self.id=Genome.id.next()
-            Genome.hash_to_id[h]=self.id
+            Genome.store.add(h,self)
             if Genome.sim:
                 Genome.sim.notify('genome.init',self)
         log.debug('Genome: id=%d', self.id)
         log.debug('%s', self)
 
+    def __getattr__(self,name):
+        '''
+        Build the allele array of a lazy genome on first use
+        '''
+        if name!='genome' or self.chromatids is None:
+            raise AttributeError(name)
+        self.genome=np.concatenate(self.chromatids)
+        self.chromatids=None
+        return self.genome
+
     def __repr__(self):
         return 'Genome(%s)'%self.genome
 
@@ -259,9 +671,49 @@ class Genome:
         #return self.display_genome()
 
     def __hash__(self):
+        return hash(self.key())
+
+    def key(self):
+        '''
+        Genome.store key: the chromosome-id tuple itself for interned
+        genomes, which are equal exactly when their ids are,
+        and likewise the tract tuple of tract genomes.
+        Otherwise the 20-byte SHA-1 digest of the chromosome digests,
+        or of the words of a packed genome.
+        '''
+        if Genome.interned or Genome.tracts:
+            return self.genome
         h=hashlib.sha1
         #h=hashlib.md5
-        return int(h(self.genome.view(np.uint8)).hexdigest(),16)
+        if self.chrom_digests is not None:
+            return h(''.join(self.chrom_digests)).digest()
+        return h(self.genome.view(np.uint8)).digest()
+
+    def same_alleles(self,other):
+        if Genome.interned or Genome.tracts:
+            return self.genome==other.genome
+        if Genome.packed:
+            return np.array_equal(self.genome,other.genome)
+        return all(c1.ctypes.data==c2.ctypes.data or np.array_equal(c1,c2)
+                   for c1,c2 in zip(self.chromosome_alleles(),other.chromosome_alleles()))
+
+    def share_alleles(self,stored):
+        '''
+        Share the stored genome's array or, if still lazy, its chromosomes
+        '''
+        self.__dict__.pop('genome',None)
+        self.chromatids=stored.chromatids
+        if stored.chromatids is None:
+            self.genome=stored.genome
+
+    def chromosome_alleles(self,genome=None):
+        '''
+        Site alleles of each chromosome of an unpacked genome,
+        without building a lazy genome
+        '''
+        if self.chromatids is not None:
+            return self.chromatids
+        return split_chromosomes(self.genome if genome is None else genome)
 
     @classmethod
     def from_reference(cls):
@@ -269,31 +721,96 @@ class Genome:
 
     @classmethod
     def from_allele_freq(cls,mod_fns=[]):
-        rands=np.random.random_sample((num_SNPs(),))
+        rands=sampling.random_sample((num_SNPs(),))
         barcode=rands<Genome.SNP_freqs
         return cls.from_barcode(barcode,mod_fns)
 
     @classmethod
     def from_barcode(cls,barcode,mod_fns=[]):
         genome=reference_genome()
-        np.put(genome,Genome.SNP_bins,barcode)
+        np.put(genome,Genome.SNP_sites,barcode)
         return cls(genome,mod_fns)
 
+    @classmethod
+    def from_allele_freqs(cls,n):
+        rands=sampling.random_sample((n,num_SNPs()))
+        return cls.from_barcodes(rands<Genome.SNP_freqs)
+
+    @classmethod
+    def from_barcodes(cls,barcodes):
+        '''
+        Genomes from the rows of a 2D barcode array,
+        constructing and hashing each distinct barcode once
+        '''
+        if not len(barcodes):
+            return []
+        barcodes,idxs=distinct_alleles(np.asarray(barcodes,dtype=np.uint8))
+        genomes=[cls.from_barcode(b) for b in barcodes]
+        return [genomes[i] for i in idxs]
+
     def fitness(self):
-        m=self.bin_fitness[self.genome!=0] # NB: assuming binary SNPs
+        '''
+        Product of the non-neutral fitness of the genome's alleles,
+        computed once over the sparse Genome.fitness_sites and cached
+        until add_locus changes Genome.bin_fitness
+        '''
+        version,fitness=self.fitness_cache
+        if version!=Genome.fitness_version:
+            fitness=self.compute_fitness()
+            self.fitness_cache=(Genome.fitness_version,fitness)
+        return fitness
+
+    def compute_fitness(self):
+        if not len(Genome.fitness_bins):
+            return 1.
+        if Genome.tracts:
+            alleles=tract_alleles(self.genome,Genome.fitness_bins)
+        else:
+            alleles=self.site_alleles(Genome.fitness_sites)
+        m=Genome.fitness_values[alleles!=0] # NB: assuming binary SNPs
         return np.product(m) if m.size else 1.
 
     def barcode(self,sites=None):
         if not sites:
-            sites=Genome.SNP_bins
-        return self.genome[sites]
+            return self.site_alleles(Genome.SNP_sites)
+        return self.site_alleles([site_from_bin(b) for b in sites])
+
+    def site_alleles(self,site_idxs=None):
+        if Genome.packed:
+            if site_idxs is None:
+                return unpack_alleles(self.genome)
+            return packed_alleles(self.genome,site_idxs)
+        if Genome.interned:
+            if site_idxs is None:
+                return np.concatenate(self.chromosomes)
+            return chromosome_site_alleles(self.chromosomes,site_idxs)
+        if Genome.tracts:
+            if site_idxs is None:
+                alleles=reference_genome()
+                bins,variants=tract_variants(self.genome)
+                alleles[np.searchsorted(Genome.site_bins,bins)]=variants
+                return alleles
+            return tract_alleles(self.genome,Genome.site_bins[site_idxs])
+        if site_idxs is None:
+            return self.genome
+        if self.chromatids is not None:
+            return chromosome_site_alleles(self.chromatids,site_idxs)
+        return self.genome[site_idxs]
+
+    def bin_alleles(self):
+        if not Genome.barcode_only:
+            return self.site_alleles()
+        alleles=np.zeros(genome_length(),dtype=np.uint8)
+        alleles[Genome.site_bins]=self.site_alleles()
+        return alleles
 
     def display_barcode(self):
         return ''.join([display_bit(b) for b in self.barcode()])
 
     def display_genome(self):
         s=[]
+        alleles=self.bin_alleles()
         for idx,(start,end) in enumerate(utils.pairwise(Genome.chrom_breaks)):
             s.append('Chromosome %s' % chrom_names[idx])
-            s.append(''.join([display_bit(b) for b in self.genome[start:end]]))
+            s.append(''.join([display_bit(b) for b in alleles[start:end]]))
         return '\n'.join(s)
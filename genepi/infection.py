@@ -1,5 +1,3 @@
-import math
-import random
 import itertools
 from collections import defaultdict
 
@@ -8,7 +6,7 @@ log = logging.getLogger(__name__)
 
 import numpy as np
 
-import utils
+import sampling
 import genome as gn
 from human import HumanIndividual
 from transmission import Transmission
@@ -17,36 +15,49 @@ max_transmit_strains=15
 
 incubation=25 # days
 
+def mean_infectiousness(t):
+    '''
+    Mean infectiousness at infection ages t (days)
+    '''
+    t=np.asarray(t,dtype=float)
+    # TODO: choose functional form based on EMOD DTK calibration
+    return np.where(t<incubation,0,0.8*np.exp(-t/50.)+0.05*np.exp(-t/300.))
+
+mean_infectiousness_by_day=mean_infectiousness(np.arange(10*365))
+
 def infectiousness(t):
-    if t<incubation:
-        return 0
+    '''
+    Array of infectiousness at infection ages t (days),
+    with the mean looked up by day of age where tabulated,
+    and noise on the mean after incubation
+    '''
+    t=np.asarray(t,dtype=float)
+    days=t.astype(int)
+    if np.all((days==t)&(days<len(mean_infectiousness_by_day))):
+        mean_prob=mean_infectiousness_by_day[days]
     else:
-        # TODO: choose functional form based on EMOD DTK calibration
-        mean_prob = 0.8 * math.exp(-t/50.) + 0.05 * math.exp(-t/300.)
-        return min(1.0, max(1e-6, mean_prob+random.gauss(0, 0.1)))
-
-def infectious_generator(t=0):
-    while True:
-        dt=yield infectiousness(t)
-        if dt: t+=dt
+        mean_prob=mean_infectiousness(t)
+    p=np.clip(mean_prob+sampling.normal(0,0.1,t.shape),1e-6,1.0)
+    p[t<incubation]=0
+    return p
 
 def get_infection_duration():
     # Maire et al. (2006)
-    return random.lognormvariate(5.13,0.8)
+    return sampling.lognormal(5.13,0.8)
 
 def sample_n_oocysts():
     # Fit A.Ouedraogo membrane feeding data from Burkina Faso
     # Private communication, in preparation (2015)
-    return 1 + int(random.weibullvariate(alpha=2.5,beta=1.0))
+    return 1 + int(sampling.weibull(1.0,2.5))
 
 def sample_n_hepatocytes():
     # Bejon et al. "Calculation of Liver-to-Blood Inocula..." (2005)
     # ln(5)~=1.6, ln(2.7)~=1
-    return max(1,int(random.lognormvariate(mu=1.8,sigma=0.8)))
+    return max(1,int(sampling.lognormal(1.8,0.8)))
 
 def sample_oocyst_products(n_hep,n_ooc):
     oocyst_product_idxs=list(itertools.product(range(n_ooc),range(4)))
-    hep_idxs=[random.choice(oocyst_product_idxs) for _ in range(n_hep)]
+    hep_idxs=[oocyst_product_idxs[i] for i in sampling.randint(len(oocyst_product_idxs),size=n_hep)]
     product_idxs=defaultdict(set)
     for o_idx,m_idx in hep_idxs:
         product_idxs[o_idx].add(m_idx)
@@ -54,6 +65,27 @@ def sample_oocyst_products(n_hep,n_ooc):
     log.debug('meiotic products to be sampled per oocyst:%s'%n_products_by_oocyst)
     return n_products_by_oocyst
 
+def plan_transmissions(n):
+    '''
+    Hepatocyte and oocyst sampling of n transmissions at once:
+    the number of distinct meiotic products sampled from each oocyst
+    infecting any hepatocyte, those of transmission i being
+    n_products[offsets[i]:offsets[i+1]]
+    '''
+    n_hep=np.maximum(1,sampling.lognormal(1.8,0.8,n).astype(int))
+    n_hep=np.minimum(n_hep,max_transmit_strains)
+    n_ooc=1+sampling.weibull(1.0,2.5,n).astype(int)
+    n_slots=4*n_ooc # (oocyst,product) pairs to sample hepatocytes from
+    events=np.repeat(np.arange(n),n_hep)
+    slots=(sampling.random_sample(len(events))*n_slots[events]).astype(int)
+    stride=n_slots.max() if n else 4
+    products=np.unique(events*stride+slots) # distinct by transmission
+    oocysts,n_products=np.unique(products//4,return_counts=True)
+    offsets=np.searchsorted(oocysts//(stride//4),np.arange(n+1))
+    log.debug('Planned %d transmissions: %d hepatocytes, %d oocysts, %d products',
+              n,n_hep.sum(),len(oocysts),len(products))
+    return offsets,n_products
+
 class Infection:
     '''
     An infection in a human containing one or more parasite strains,
@@ -62,77 +94,113 @@ class Infection:
     '''
 
     id=itertools.count()
+    table=None # InfectionTable holding the infection timers, if any
+    sampler=None # WeightedSampler of gametocyte strains, until they change
+    sampler_version=-1 # Genome.fitness_version of the sampler weights
 
     def __init__(self,parent,genomes=[]):
         self.id=Infection.id.next()
         log.debug('Infection: id=%d', self.id)
         self.parent=parent
         self.set_infection_timers()
-        self.genomes=genomes
+        self.genomes=gn.Genome.store.acquire(genomes)
+        self.genome_ids=set(g.id for g in self.genomes)
         log.debug('%s', self)
 
     def __str__(self):
         return '\n'.join([str(g) for g in self.genomes])
 
     def set_infection_timers(self,t=0):
-        self.infectiousness=infectious_generator(t)
-        self.infectiousness.send(None)
-        self.infection_timer=get_infection_duration()
+        self.set_infection_state(get_infection_duration(),t)
+
+    def set_infection_state(self,infection_timer,age):
+        self.age=age
+        self.infection_timer=infection_timer
+        if self.table is not None:
+            self.table.update_timers(self)
+
+    def infectiousness(self):
+        return infectiousness([self.age])[0]
+
+    def expire(self):
+        self.set_infection_state(0,self.age)
 
     def update(self,dt,vectorial_capacity):
         self.infection_timer  -= dt
-        self.infectiousness.send(dt)
-        fitness = [g.fitness() for g in self.genomes]
-        if not fitness:
+        self.age += dt
+        if not self.genomes:
             return [] # no genomes (e.g. from drug clearance)
-        mean_fitness = np.mean(fitness) # TODO: something other than mean?
-        transmit_rate = vectorial_capacity*dt*next(self.infectiousness)*mean_fitness
-        n_transmit=utils.poissonRandom(transmit_rate)
+        mean_fitness = np.mean(self.fitness()) # TODO: something other than mean?
+        transmit_rate = vectorial_capacity*dt*self.infectiousness()*mean_fitness
+        n_transmit=sampling.poisson(transmit_rate)
         log.debug('  id=%d: infection_timer=%d  transmit_rate=%0.2f  n_transmit=%d',
                   self.id,self.infection_timer,transmit_rate,n_transmit)
-        transmissions=[self.transmit() for _ in range(n_transmit)]
-        return transmissions
+        return self.transmit_planned(*plan_transmissions(n_transmit))
 
     def transmit(self):
+        return self.transmit_planned(*plan_transmissions(1))[0]
+
+    def transmit_planned(self,offsets,n_products):
+        '''
+        The sporozoites of each transmission planned by plan_transmissions,
+        from one batch of gametocyte pairs and meioses
+        '''
         if self.n_strains() == 1:
             clone=self.genomes[0]
             log.debug('Clonal transmission of genome id=%d'%clone.id)
-            return [Transmission((clone.id,clone.id),clone,self)]
-        n_hep,n_ooc=sample_n_hepatocytes(),sample_n_oocysts()
-        log.debug('Sample %d hepatocyte(s) from %d oocyst(s):',n_hep,n_ooc)
-        if n_hep > max_transmit_strains:
-            log.debug('Truncating to %d hepatocytes:',max_transmit_strains)
-            n_hep=max_transmit_strains
-        n_products=sample_oocyst_products(n_hep,n_ooc)
+            return [[Transmission((clone.id,clone.id),clone,self)] for _ in range(len(offsets)-1)]
         gametocyte_pairs=self.sample_gametocyte_pairs(len(n_products))
-        sporozoites=gn.distinct_sporozoites_from(gametocyte_pairs,n_products)
-        for s in sporozoites:
-            s.parentInfection=self
-        return sporozoites
+        transmissions=gn.distinct_sporozoites_from(gametocyte_pairs,n_products,offsets)
+        for sporozoites in transmissions:
+            for s in sporozoites:
+                s.parentInfection=self
+        return transmissions
 
     def sample_gametocyte_pairs(self, N):
-        pairs=[]
-        w=self.gametocyte_strain_cdf()
-        for _ in range(N):
-            pairs.append([self.select_strain(w),self.select_strain(w)])
-        return pairs
-
-    def select_strain(self,cumwts):
-        return self.genomes[utils.weighted_choice(cumwts)]
+        idxs=self.gametocyte_sampler().draw(2*N)
+        return [[self.genomes[i],self.genomes[j]] for i,j in zip(idxs[::2],idxs[1::2])]
+
+    def gametocyte_sampler(self):
+        '''
+        Sampler of gametocyte strains, rebuilt when the strains change
+        or add_locus changes their fitness
+        '''
+        # TODO: something more skewed
+        #       to account for blood-stage dynamics, e.g. in EMOD DTK
+        if self.sampler is None or self.sampler_version!=gn.Genome.fitness_version:
+            self.sampler=sampling.WeightedSampler(self.fitness()) # fitness weighted
+            self.sampler_version=gn.Genome.fitness_version
+        return self.sampler
 
     def expired(self):
         return self.infection_timer<=0
 
-    def gametocyte_strain_cdf(self):
-        # TODO: something more skewed
-        #       to account for blood-stage dynamics, e.g. in EMOD DTK
-        #return utils.accumulate_cdf([1]*self.n_strains()) # random
-        return utils.accumulate_cdf([g.fitness() for g in self.genomes]) # fitness weighted
+    def fitness(self):
+        return gn.Genome.store.fitness(self.genomes)
 
     def n_strains(self):
         return len(self.genomes)
 
+    def set_genomes(self,genomes):
+        genomes=gn.Genome.store.acquire(genomes)
+        gn.Genome.store.release(self.genomes)
+        self.genomes=genomes
+        self.genome_ids=set(g.id for g in genomes)
+        self.sampler=None
+        if self.table is not None:
+            self.table.update_strains(self)
+
     def merge_infection(self,genomes):
-        self.genomes.extend(genomes)
-        self.genomes=gn.distinct(self.genomes)
+        '''
+        Add the strains not already in the infection,
+        in time proportional to the number of genomes merged
+        '''
+        genomes=gn.Genome.store.canonical(genomes)
+        added=[g for g in gn.distinct(genomes) if g.id not in self.genome_ids]
+        gn.Genome.store.acquire(added)
+        self.genomes.extend(added)
+        self.genome_ids.update(g.id for g in added)
+        self.sampler=None
+        if self.table is not None:
+            self.table.update_strains(self)
         self.set_infection_timers(t=incubation)
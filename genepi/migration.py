@@ -1,6 +1,9 @@
 import math
-import random
 import utils
+import sampling
+
+import numpy as np
+from scipy import sparse
 
 import logging
 log = logging.getLogger(__name__)
@@ -25,8 +28,10 @@ class Migration:
 class MigrationInfo:
     def __init__(self,rates):
         self.destinations=rates.keys()
+        self.rates=rates.values()
         self.relative_rates=utils.accumulate_cdf(rates.values())
         self.total_rate=sum(rates.values())
+        self.sampler=sampling.WeightedSampler(self.rates)
 
     def __str__(self):
         s  = 'destinations=%s: '  % self.destinations
@@ -35,16 +40,86 @@ class MigrationInfo:
         return s
 
     def pick_destination(self):
-        return self.destinations[utils.weighted_choice(self.relative_rates)]
+        return self.destinations[self.sampler.draw()]
 
     def next_migration(self):
         if not self.total_rate:
             return Migration() # nowhere to migrate
-        in_days=random.expovariate(self.total_rate)
+        in_days=sampling.exponential(1./self.total_rate)
         return Migration(in_days, self.pick_destination())
 
-    def destinations_in_timestep(self,n_humans,dt):
+    def migrants_in_timestep(self,n_humans,dt):
+        '''
+        Number of n_humans migrating to each destination within dt
+        '''
+        if not self.total_rate:
+            return {}
         prob=1-math.exp(-self.total_rate*dt)
-        migrants=utils.binomialApproxRandom(n_humans,prob)
+        migrants=sampling.binomial(int(n_humans),prob)
         log.debug('(humans,prob,migrants)=(%d,%0.2f,%d)',n_humans,prob,migrants)
-        return [self.pick_destination() for _ in range(migrants)]
+        counts=sampling.multinomial(migrants,self.rates)
+        return dict(zip(self.destinations,counts.tolist()))
+
+    def destinations_in_timestep(self,n_humans,dt):
+        migrants=self.migrants_in_timestep(n_humans,dt)
+        return [d for d,n in migrants.items() for _ in range(n)]
+
+    def next_migrations(self,n):
+        '''
+        Next migration of each of n individuals, drawn at once
+        '''
+        if not self.total_rate:
+            return [Migration() for _ in range(n)]
+        in_days=sampling.exponential(1./self.total_rate,n)
+        destinations=self.sampler.draw(n)
+        return [Migration(t,self.destinations[d]) for t,d in zip(in_days,destinations)]
+
+class MigrationMatrix:
+    '''
+    Sparse (CSR) matrix of migration rates between all populations,
+    row by source and column by destination, so that the cohort flows
+    of every population in a timestep are drawn at once
+    '''
+
+    def __init__(self,ids,rates):
+        self.ids=list(ids)
+        self.index={id:i for i,id in enumerate(self.ids)}
+        src,dest,data=[],[],[]
+        for id,dest_rates in rates.items():
+            for d,r in dest_rates.items():
+                if d not in self.index:
+                    raise Exception('Unknown migration destination %s from %s.'%(d,id))
+                src.append(self.index[id])
+                dest.append(self.index[d])
+                data.append(r)
+        n=len(self.ids)
+        self.rates=sparse.csr_matrix((data,(src,dest)),shape=(n,n))
+        self.rates.eliminate_zeros()
+        self.total_rates=np.asarray(self.rates.sum(axis=1)).ravel()
+        log.debug('Migration matrix: %d populations, %d routes',n,self.rates.nnz)
+
+    @classmethod
+    def from_populations(cls,populations):
+        rates={id:dict(zip(p.migration_info.destinations,p.migration_info.rates))
+               for id,p in populations.items()}
+        return cls(sorted(populations.keys()),rates)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def cohort_flows(self,n_humans,dt):
+        '''
+        Sparse matrix of the number of n_humans of each source
+        migrating to each destination within dt
+        '''
+        prob=1-np.exp(-self.total_rates*dt)
+        migrants=sampling.binomial(np.asarray(n_humans,dtype=int),prob)
+        counts=sampling.multinomial_rows(migrants,self.rates.indptr,self.rates.data)
+        return sparse.csr_matrix((counts,self.rates.indices,self.rates.indptr),shape=self.rates.shape)
+
+    def net_flows(self,n_humans,dt):
+        '''
+        Change in n_humans of each population from cohort flows within dt
+        '''
+        flows=self.cohort_flows(n_humans,dt)
+        return np.asarray(flows.sum(axis=0)).ravel()-np.asarray(flows.sum(axis=1)).ravel()
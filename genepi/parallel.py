@@ -0,0 +1,212 @@
+'''
+Process-parallel stepping of the populations of a Simulation.
+
+Each worker process is forked with a copy of the simulation and steps
+a partition of its populations. Populations only interact through
+migration, so at the end of each timestep every worker sends its
+emigrants to other workers and its susceptible cohort sizes to all,
+through the parent process, which waits for every worker before
+routing them (a barrier). Reports are merged when the workers finish.
+Events targeting a population run in the worker stepping it, and other
+events in every worker, on the populations it steps.
+
+Genomes are sent by their site alleles and keep their ids, which are
+globally unique as each worker numbers new genomes (and individuals
+and infections) from its own residue class of ids, i.e. strided by
+the number of workers rather than in contiguous blocks it could run out of.
+
+With seed_per_population, every population draws from its own stream
+and cohort flows from a shared migration stream, so results do not
+depend on the number of workers, up to the numbering of ids and the
+genomes reported as new, which follow the genome store of each worker.
+'''
+
+import itertools
+import traceback
+import multiprocessing
+from collections import defaultdict
+
+import logging
+log = logging.getLogger(__name__)
+
+import numpy as np
+
+import genome as gn
+from human import HumanIndividual
+from infection import Infection
+
+def partition(ids,n_workers):
+    '''
+    Contiguous blocks of population ids, one for each worker
+    '''
+    return [list(p) for p in np.array_split(np.array(ids,dtype=object),n_workers)]
+
+def stride_ids(cls,worker,n_workers):
+    start=cls.id.next()
+    cls.id=itertools.count(start+worker,n_workers)
+
+def pack_emigrants(migrants):
+    '''
+    Emigrants by destination as (emigrant,src_pop,genome ids) records,
+    without their populations and genomes, and the site alleles
+    of their genomes by id
+    '''
+    records,genomes=defaultdict(list),{}
+    for dest,emigrant_and_src_list in migrants.items():
+        for emigrant,src in emigrant_and_src_list:
+            infection=emigrant.infection
+            for g in infection.genomes:
+                if g.id not in genomes:
+                    genomes[g.id]=g.site_alleles()
+            ids=[g.id for g in infection.genomes]
+            infection.set_genomes([])
+            emigrant.parent=None
+            records[dest].append((emigrant,src,ids))
+    return dict(records),genomes
+
+def unpack_immigrants(records,genomes):
+    '''
+    Immigrants by destination as (immigrant,src_pop) pairs,
+    their genomes restored from site alleles
+    '''
+    restored={}
+    def genome(id):
+        if id not in restored:
+            restored[id]=gn.Genome(genomes[id],id=id)
+        return restored[id]
+    migrants=defaultdict(list)
+    for dest,record_list in records.items():
+        for immigrant,src,ids in record_list:
+            immigrant.infection.set_genomes([genome(id) for id in ids])
+            migrants[dest].append((immigrant,src))
+    return migrants
+
+class Exchange:
+    '''
+    A worker's end of the barrier-synchronized exchange with the others
+    '''
+
+    def __init__(self,conn,ids):
+        self.conn=conn
+        self.ids=set(ids) # populations stepped by this worker
+
+    def send(self,*msg):
+        self.conn.send(msg)
+        return self.conn.recv()[1:]
+
+    def rates(self,rates):
+        '''
+        Transmission rates of all populations, from those of this worker's
+        '''
+        return self.send('rates',rates)[0]
+
+    def migrate(self,migrants,n_susceptible):
+        '''
+        Emigrants to this worker's populations and the cohort sizes of
+        all populations, from those of this worker's
+        '''
+        local=defaultdict(list)
+        remote={}
+        for dest,emigrant_and_src_list in migrants.items():
+            if dest in self.ids:
+                local[dest].extend(emigrant_and_src_list)
+            else:
+                remote[dest]=emigrant_and_src_list
+        records,genomes=pack_emigrants(remote)
+        records,genomes,n_susceptible=self.send('migrate',records,genomes,n_susceptible)
+        for dest,immigrants in unpack_immigrants(records,genomes).items():
+            local[dest].extend(immigrants)
+        return local,n_susceptible
+
+def work(simulation,conn,ids,worker,n_workers):
+    '''
+    Step the populations with the given ids to the end of the simulation,
+    then send the results of its reports and listeners
+    '''
+    try:
+        for cls in (gn.Genome,HumanIndividual,Infection):
+            stride_ids(cls,worker,n_workers)
+        simulation.populations={id:simulation.populations[id] for id in ids}
+        simulation.exchange=Exchange(conn,ids)
+        reports=simulation.reports+[l for _,ll in sorted(simulation.listeners.items()) for l in ll]
+        for r in reports:
+            r.clear()
+        simulation.run_steps()
+        conn.send(('done',simulation.day,[r.results() for r in reports]))
+    except Exception:
+        conn.send(('error',traceback.format_exc()))
+    finally:
+        conn.close()
+
+def route(msgs,owners,n_workers):
+    '''
+    Replies to the 'migrate' messages of all workers: each worker's
+    immigrants by destination, in worker order, and the genomes they
+    carry, with the cohort sizes of all populations
+    '''
+    records=[defaultdict(list) for _ in range(n_workers)]
+    genomes=[{} for _ in range(n_workers)]
+    n_susceptible={}
+    for _,sent_records,sent_genomes,sent_n_susceptible in msgs:
+        n_susceptible.update(sent_n_susceptible)
+        for dest,record_list in sent_records.items():
+            w=owners[dest]
+            records[w][dest].extend(record_list)
+            for _,_,ids in record_list:
+                for id in ids:
+                    genomes[w][id]=sent_genomes[id]
+    return [('migrate',dict(r),g,n_susceptible) for r,g in zip(records,genomes)]
+
+def run(simulation,n_workers):
+    '''
+    Run the simulation in n_workers processes and merge their reports.
+    The populations of the simulation itself are left as they were.
+    '''
+    if gn.Genome.tracts:
+        raise Exception('Parallel simulation does not exchange tract genomes.')
+    ids=simulation.migration_matrix().ids
+    partitions=[p for p in partition(ids,min(n_workers,len(ids))) if p]
+    owners={id:w for w,p in enumerate(partitions) for id in p}
+    log.info('Stepping %d populations in %d workers',len(ids),len(partitions))
+
+    conns,workers=[],[]
+    for w,p in enumerate(partitions):
+        conn,worker_conn=multiprocessing.Pipe()
+        process=multiprocessing.Process(target=work,args=(simulation,worker_conn,p,w,len(partitions)))
+        process.start()
+        conns.append(conn)
+        workers.append(process)
+
+    try:
+        while True:
+            msgs=[c.recv() for c in conns] # barrier
+            kinds=set(m[0] for m in msgs)
+            if 'error' in kinds:
+                errors=[m[1] for m in msgs if m[0]=='error']
+                raise Exception('Parallel simulation failed:\n%s'%'\n'.join(errors))
+            if kinds=={'done'}:
+                break
+            if len(kinds)>1:
+                raise Exception('Workers out of step: %s'%sorted(kinds))
+            if kinds=={'rates'}:
+                rates={}
+                for m in msgs:
+                    rates.update(m[1])
+                replies=[('rates',rates)]*len(conns)
+            else:
+                replies=route(msgs,owners,len(conns))
+            for c,r in zip(conns,replies):
+                c.send(r)
+    except:
+        for process in workers:
+            process.terminate()
+        raise
+    finally:
+        for process in workers:
+            process.join()
+
+    simulation.day=msgs[0][1]
+    reports=simulation.reports+[l for _,ll in sorted(simulation.listeners.items()) for l in ll]
+    for m in msgs:
+        for r,results in zip(reports,m[2]):
+            r.merge(results)
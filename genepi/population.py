@@ -9,11 +9,13 @@ import logging
 log = logging.getLogger(__name__)
 
 import utils
+import sampling
 import genome as gn
 import infection as inf
 from human import HumanCohort,HumanIndividual
 from migration import MigrationInfo
-from scipy.stats import rv_discrete
+from table import InfectionTable
+from forcing import Forcing
 
 class Population:
     '''
@@ -26,24 +28,30 @@ class Population:
                  migration_rates={}, 
                  coi={1:1},
                  r0_params={'r0' : [1, 1],'day' : [0,20*365]},
-                 annual_cycle =  lambda t:0.05
+                 annual_cycle =  lambda t:0.05,
+                 vectorial_capacity_fn=None,
+                 vectorial_capacity_forcing=None
                  ):
                  
         self.id=id
         self.parent=parent
+        self.rng=self.determine_stream()
         self.migration_info=MigrationInfo(migration_rates)
         self.susceptibles=HumanCohort(self,n_humans)
-        self.infecteds={}
+        self.infecteds=InfectionTable() # infected individuals, indexed by row
         if n_infections > n_humans:
             raise Exception('Initial infections not to exceed initial humans.')
         self.coi = coi        
         self.annual_cycle=annual_cycle
         self.r0_params = r0_params
-        self.vectorial_capacity_fn = self.determine_vectorial_capacity_function(self.r0_params)
+        self.forcing = self.determine_forcing(vectorial_capacity_fn,vectorial_capacity_forcing)
         
-        for _ in range(n_infections):
-            complexity=rv_discrete(values=(self.coi.keys(),self.coi.values())).rvs()
-            self.add_infection_from_genomes([gn.Genome.from_allele_freq() for c in range(complexity)])
+        with sampling.stream(self.rng):
+            coi_sampler=sampling.WeightedSampler(self.coi.values())
+            complexities=[self.coi.keys()[i] for i in coi_sampler.draw(n_infections)]
+            genomes=gn.Genome.from_allele_freqs(sum(complexities))
+            for start,end in utils.pairwise([0]+list(utils.cumsum(complexities))):
+                self.add_infection_from_genomes(genomes[start:end])
         log.debug(self)
 
     def __str__(self):
@@ -52,6 +60,13 @@ class Population:
         s += 'infections=%d ' % len(self.infecteds)
         return s        
     
+    def set_migration_rates(self,migration_rates):
+        '''
+        Migration rates by destination from now on, e.g. in an event,
+        for the cohort flows and the next migration of each individual
+        '''
+        self.migration_info=MigrationInfo(migration_rates)
+
     def add_infection_from_genomes(self,genomes):
         ii=self.add_new_infection(genomes)
         if ii:
@@ -63,53 +78,150 @@ class Population:
         if not individual:
             individual=self.susceptibles.pop_individual()
         individual.infection=inf.Infection(individual,genomes)
-        self.infecteds[individual.id]=individual
+        self.add_infected(individual)
         return individual.infection
 
-    def transmit_infections(self,transmissions):
+    def add_infected(self,individual):
+        self.infecteds.add(individual)
+
+    def remove_infected(self,individual):
+        self.infecteds.remove(individual)
+        return individual
+
+    def transmit_infections(self,transmissions,day=None):
+        '''
+        Infect random individuals with transmissions, returning the rows
+        of the infected individuals whose infection they merge into
+        '''
+        superinfected=[]
         n_infections=len(transmissions)
         log.debug('Add %d infections:',n_infections)
-        idxs=utils.choose_with_replacement(n_infections,self.n_humans())
+        idxs=sampling.randint(self.n_humans(),size=n_infections)
         log.debug('Selected individual indices: %s',idxs)
         for idx,transmission in zip(idxs,transmissions):
             genomes=[t.genome for t in transmission]
             if idx<len(self.infecteds):
-                i=self.infecteds.values()[idx]
+                i=self.infecteds.individuals[idx]
                 i.infection.merge_infection(genomes)
                 log.debug('Merged strains (idx=%d, id=%d):\n%s',
                           idx,i.id,i.infection)
-                self.notify_transmission(transmission,i.infection)
+                self.notify_transmission(transmission,i.infection,day)
+                superinfected.append(idx)
             else:
                 log.debug('New infected individual:\n%s',genomes)
                 infection=self.add_new_infection(genomes)
                 if infection:
-                    self.notify_transmission(transmission,infection)
+                    self.notify_transmission(transmission,infection,day)
+        return superinfected
 
-    def notify_transmission(self,transmission,infection=None):
+    def notify_transmission(self,transmission,infection=None,day=None):
+        '''
+        Report transmission on day, by default the simulation day,
+        e.g. the time of a reaction within a step of advance
+        '''
         for t in transmission:
             if infection:
                 t.infection=infection
             t.populationId=self.id
-            t.day=self.parent.day
+            t.day=self.parent.day if day is None else day
         self.parent.notify('infection.transmit',transmission)
 
     def update(self,dt):
         transmissions=[]
         V=self.vectorial_capacity()
         log.info('%s vectorial capacity=%0.2f',self,V)
-        for iid,i in self.infecteds.items():
-            tt=i.update(dt)
-            transmissions.extend(tt)
-            if i.infection.expired():
-                expired=self.infecteds.pop(iid)
-                self.susceptibles.merge_individual(expired)
-            elif i.migration.migrating():
-                emigrant=self.infecteds.pop(iid)
-                self.transmit_emigrant(emigrant)
+        table=self.infecteds
+        n_transmit,expired,migrating=table.step(dt,V)
+        idxs=np.flatnonzero(n_transmit)
+        offsets,n_products=inf.plan_transmissions(n_transmit[idxs].sum())
+        events=0
+        for idx in idxs:
+            infection=table.individuals[idx].infection
+            o=offsets[events:events+n_transmit[idx]+1]
+            transmissions.extend(infection.transmit_planned(o-o[0],n_products[o[0]:o[-1]]))
+            events+=n_transmit[idx]
+        self.remove_due(expired,migrating)
         if transmissions:
             self.transmit_infections(transmissions)
-        self.cohort_migration(dt)
+
+    def remove_due(self,expired,migrating):
+        table=self.infecteds
+        expired=[table.individuals[idx] for idx in expired]
+        emigrants=[table.individuals[idx] for idx in migrating]
+        for i in expired:
+            self.remove_infected(i)
+            i.infection.set_genomes([])
+            self.susceptibles.merge_individual(i)
+        for i in emigrants:
+            self.remove_infected(i)
+        self.transmit_emigrants(emigrants)
+
+    def advance(self,dt,max_interval=1):
+        '''
+        Continuous-time alternative to update: each transmission,
+        clearance and migration is the next reaction in time.
+        Transmission times are thinned from a Poisson process at upper
+        bounds of the mean transmission rates, which only decrease with
+        infection age after incubation. The vectorial capacity forcing is
+        constant over each day, so over intervals of at most one day
+        (max_interval) it is bounded by its values at either end.
+        Infections transmit at their mean infectiousness,
+        without the per-step noise of update.
+
+        The bounds and their sampler are computed once per interval,
+        and only the bounds of superinfected rows are updated after
+        a transmission, as new infections are still incubating
+        at the end of the interval unless superinfected.
+        '''
+        table=self.infecteds
+        end_day=table.day+dt
+        while table.day<end_day:
+            day=table.day
+            horizon=min(end_day,day+max_interval,table.next_day())
+            V=max(self.forcing(day),self.forcing(horizon))
+            bounds=sampling.WeightedSampler(table.transmit_rates(V))
+            while True:
+                total=bounds.total()
+                day+=sampling.exponential(1/total) if total>0 else np.inf
+                if day>=horizon:
+                    break
+                table.advance(day) # nothing due before horizon
+                idx=bounds.draw()
+                rate=table.transmit_rates(self.forcing(day),[idx])[0]
+                if sampling.random_sample()*bounds.weight(idx)<rate:
+                    infection=table.individuals[idx].infection
+                    transmissions=infection.transmit_planned(*inf.plan_transmissions(1))
+                    for row in self.transmit_infections(transmissions,day):
+                        bounds.update(row,table.transmit_rates(V,[row])[0])
+                        horizon=min(horizon,table.clearance[row])
+            self.remove_due(*table.advance(horizon))
     
+    def determine_stream(self):
+        '''
+        The population's own RandomState, seeded from the simulation's
+        random_seed and the population id if seed_per_population,
+        so that its draws do not depend on those of other populations,
+        or else the shared sampling stream
+        '''
+        params=getattr(self.parent,'params',None)
+        if getattr(params,'seed_per_population',False):
+            return sampling.seeded(params.random_seed,self.id)
+        return sampling.rng
+
+    def determine_forcing(self,vectorial_capacity_fn=None,vectorial_capacity_forcing=None):
+        '''
+        Vectorial capacity by day from a forcing file or daily series,
+        or else tabulated as the days come from vectorial_capacity_fn,
+        or from r0_params and annual_cycle
+        '''
+        if isinstance(vectorial_capacity_forcing,basestring):
+            return Forcing.from_file(vectorial_capacity_forcing)
+        if vectorial_capacity_forcing is not None:
+            return Forcing(vectorial_capacity_forcing)
+        if not vectorial_capacity_fn:
+            vectorial_capacity_fn=self.determine_vectorial_capacity_function(self.r0_params)
+        return Forcing.from_function(vectorial_capacity_fn)
+
     def determine_vectorial_capacity_function(self, r0_params):
         initial_r0 = self.r0_params['r0'][0]
         
@@ -134,8 +246,14 @@ class Population:
             return vectorial_capacity
         return function
     
+    def transmission_rate(self):
+        '''
+        Expected transmissions per day at the current rates
+        '''
+        return self.infecteds.transmit_rates(self.vectorial_capacity()).sum()
+
     def vectorial_capacity(self):
-        return self.vectorial_capacity_fn(t=self.parent.day)
+        return self.forcing(self.parent.day)
 
     def n_humans(self):
         return self.susceptibles.n_humans+len(self.infecteds)
@@ -144,30 +262,26 @@ class Population:
         return len(self.infecteds)
 
     def n_polygenomic(self):
-        return sum([i.infection.n_strains()>1 for i in self.infecteds.values()])
+        return np.count_nonzero(self.infecteds.column('n_strains')>1)
     
     def coi_distribution(self):
-        return collections.Counter([i.infection.n_strais() for i in self.infected.values()])
+        return collections.Counter(self.infecteds.column('n_strains').astype(int).tolist())
         
     def calculate_average_coi(self):
-        return np.mean([i.infection.n_strains() for i in self.infecteds.values()])
+        return np.mean(self.infecteds.column('n_strains'))
         
-    def transmit_emigrant(self,emigrant):
-        src_pop,dest_pop=self.id,emigrant.migration.destination
-        self.parent.migrants[dest_pop].append((emigrant,src_pop))
-
-    def cohort_migration(self,dt):
-        mig_dest=self.migration_info.destinations_in_timestep
-        destinations=mig_dest(self.susceptibles.n_humans,dt)
-        self.susceptibles.n_humans -= len(destinations)
-        for dest in destinations:
-            self.parent.cohort_migrants[dest]+=1
-        log.debug('Cohort migration from %s: %s',self.id,destinations)
-
-    def receive_immigrant(self,immigrant,src_pop):
-        immigrant.migration=self.migration_info.next_migration()
-        # TODO: extend random migration to round-trip concepts using src_pop
-        immigrant.parent=self
-        self.infecteds[immigrant.id]=immigrant
-        
-    
+    def transmit_emigrants(self,emigrants):
+        for i in emigrants:
+            self.parent.migrants[i.migration.destination].append((i,self.id))
+
+    def receive_immigrants(self,immigrants):
+        '''
+        Add infected (immigrant,src_pop) pairs, drawing
+        their next migrations from here at once
+        '''
+        migrations=self.migration_info.next_migrations(len(immigrants))
+        for (immigrant,src_pop),migration in zip(immigrants,migrations):
+            immigrant.migration=migration
+            # TODO: extend random migration to round-trip concepts using src_pop
+            immigrant.parent=self
+        self.infecteds.extend([i for i,_ in immigrants])
@@ -11,6 +11,10 @@ from ..infection import Transmission
 class Listener:
     def notify(self,*args): pass
     def write(self, working_directory): pass
+    # accumulated results of the populations stepped in a worker process
+    def clear(self): pass
+    def results(self): pass
+    def merge(self, results): pass
 
 class TransmissionGeneticsReport(Listener):
     '''
@@ -22,8 +26,17 @@ class TransmissionGeneticsReport(Listener):
         self.report_filename=report_filename
         self.parent=parent
         self.event='infection.transmit'
+        self.clear()
+
+    def clear(self):
         self.data=[]
 
+    def results(self):
+        return self.data
+
+    def merge(self, results):
+        self.data=sorted(self.data+results, key=lambda r: r[0]) # by day
+
     def notify(self,*args):
         try:
             transmission=args[0]
@@ -46,7 +59,9 @@ class TransmissionGeneticsReport(Listener):
 
 class GenomeReport(Listener):
     '''
-    A helper class to record map of Genome.id to Genome.genome
+    A helper class to record map of Genome.id to Genome.genome,
+    and the (gid,start_bin,end_bin,founder_id) ancestry tracts
+    of tract genomes
     '''
 
     def __init__(self, parent, report_filename='GenomeReport'):
@@ -54,7 +69,21 @@ class GenomeReport(Listener):
         self.parent=parent
         self.event='genome.init'
         self.header=gn.Genome.SNP_names
+        self.clear()
+
+    def clear(self):
+        self.ids=[]
         self.data=[]
+        self.tracts=[]
+
+    def results(self):
+        return self.ids, self.data, self.tracts
+
+    def merge(self, results):
+        ids, data, tracts = results
+        self.ids.extend(ids)
+        self.data.extend(data)
+        self.tracts.extend(tracts)
 
     def notify(self,*args):
         try:
@@ -63,7 +92,10 @@ class GenomeReport(Listener):
         except:
             raise Exception('Expected Genome object as first argument.')
         barcode=g.barcode()
+        self.ids.append(g.id)
         self.data.append(barcode)
+        if gn.Genome.tracts:
+            self.tracts.extend((g.id,)+t for t in g.genome)
 
     # TODO: performance may be improved by doing one or both of:
     #       - store genomes instead of barcodes on notify,
@@ -75,5 +107,13 @@ class GenomeReport(Listener):
         filename=os.path.join(working_directory, self.report_filename)
         if not os.path.exists(os.path.dirname(filename)):
             os.makedirs(os.path.dirname(filename))
-        A=np.array(self.data)
-        np.savez(filename,genomes=A,header=self.header)
+        order=np.argsort(self.ids, kind='mergesort')
+        ids=np.array(self.ids)[order]
+        A=np.array(self.data)[order]
+        if not gn.Genome.tracts:
+            np.savez(filename,genomes=A,ids=ids,header=self.header)
+        else:
+            np.savez(filename,genomes=A,ids=ids,header=self.header,
+                     tracts=np.array(self.tracts,dtype=np.int64).reshape(-1,4),
+                     chrom_breaks=gn.Genome.chrom_breaks,
+                     bin_size=gn.Genome.bin_size_bp)
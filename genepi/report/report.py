@@ -8,6 +8,10 @@ log = logging.getLogger(__name__)
 class Report:
     def update(self): pass
     def write(self, working_directory): pass
+    # accumulated results of the populations stepped in a worker process
+    def clear(self): pass
+    def results(self): pass
+    def merge(self, results): pass
 
 class PopulationInfectionReport(Report):
     '''
@@ -18,6 +22,9 @@ class PopulationInfectionReport(Report):
     def __init__(self, parent, report_filename='PopulationInfectionReport.json'):
         self.report_filename=report_filename
         self.parent=parent
+        self.clear()
+
+    def clear(self):
         self.data={'tsteps':[],
                    'n_humans':defaultdict(list),
                    'f_infected':defaultdict(list),
@@ -45,10 +52,19 @@ class PopulationInfectionReport(Report):
             coi_distribution = p.coi_distribution()
             self.data['coi_distribution'][pid].append(coi_distribution)
 
+    def results(self):
+        return self.data
+
+    def merge(self, results):
+        self.data['tsteps']=results['tsteps']
+        for k,v in results.items():
+            if k!='tsteps':
+                self.data[k].update(v)
+
     def write(self, working_directory):
         self.data['populations']=self.parent.populations.keys()
         filename=os.path.join(working_directory, self.report_filename)
         if not os.path.exists(os.path.dirname(filename)):
             os.makedirs(os.path.dirname(filename))
-        with open(filename,'w') as outfile/:
+        with open(filename,'w') as outfile:
             json.dump(self.data, outfile, sort_keys=True)
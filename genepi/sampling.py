@@ -0,0 +1,137 @@
+'''
+Batched random draws over arrays, from a numpy RandomState
+seeded by the Simulation alongside the random module,
+or from the stream of a population while it is stepped
+'''
+
+import zlib
+from contextlib import contextmanager
+
+import logging
+log = logging.getLogger(__name__)
+
+import numpy as np
+
+rng = np.random.RandomState()
+
+def seed(s):
+    rng.seed(s)
+
+def seeded(s,key):
+    '''
+    A RandomState seeded by s and a key, e.g. a population id,
+    that is independent of the order in which streams are made
+    '''
+    return np.random.RandomState([s,zlib.crc32(str(key))&0xffffffff])
+
+@contextmanager
+def stream(r):
+    '''
+    Draw from RandomState r within the context
+    '''
+    global rng
+    previous,rng=rng,r
+    try:
+        yield r
+    finally:
+        rng=previous
+
+def poisson(lam):
+    '''
+    Exact Poisson draws with mean(s) lam
+    '''
+    return rng.poisson(np.maximum(lam,0))
+
+def binomial(n,p):
+    '''
+    Exact binomial draws of n trials with probability p,
+    p above one being taken as certain success
+    '''
+    p=np.asarray(p,dtype=float)
+    if np.any(p>1):
+        log.warning('Fixing probability %s>1.0 to one.',p.max())
+    return rng.binomial(n,np.clip(p,0,1))
+
+def multinomial(n,pvals):
+    '''
+    Exact multinomial counts of n trials over categories
+    with probabilities pvals, normalized to sum to one
+    '''
+    pvals=np.asarray(pvals,dtype=float)
+    return rng.multinomial(n,pvals/pvals.sum())
+
+def multinomial_rows(n,indptr,weights):
+    '''
+    Exact multinomial counts of n[i] trials over the categories
+    weights[indptr[i]:indptr[i+1]] of each row i of a CSR matrix,
+    drawn for all rows at once as a binomial split of the remaining
+    trials, one category position at a time
+    '''
+    remaining=np.array(n,dtype=int)
+    weights=np.asarray(weights,dtype=float)
+    starts,lengths=indptr[:-1],np.diff(indptr)
+    # probability of each category given the later ones in its row
+    cumulative=np.concatenate([[0],np.cumsum(weights)])
+    later=np.repeat(cumulative[indptr[1:]],lengths)-cumulative[:-1]
+    p=np.where(later>0,weights/np.where(later>0,later,1),0)
+    p[indptr[1:][lengths>0]-1]=1
+    counts=np.zeros(len(weights),dtype=int)
+    for k in range(lengths.max() if len(lengths) else 0):
+        rows=np.flatnonzero(lengths>k)
+        idxs=starts[rows]+k
+        counts[idxs]=rng.binomial(remaining[rows],np.clip(p[idxs],0,1))
+        remaining[rows]-=counts[idxs]
+    return counts
+
+def normal(loc=0.,scale=1.,size=None):
+    return rng.normal(loc,scale,size)
+
+def lognormal(mean=0.,sigma=1.,size=None):
+    return rng.lognormal(mean,sigma,size)
+
+def weibull(shape,scale=1.,size=None):
+    return scale*rng.weibull(shape,size)
+
+def randint(high,size=None):
+    '''
+    Uniform draws of integers from 0 to high-1
+    '''
+    return rng.randint(high,size=size)
+
+def exponential(scale=1.,size=None):
+    return rng.exponential(scale,size)
+
+def random_sample(size=None):
+    return rng.random_sample(size)
+
+class WeightedSampler:
+    '''
+    Draws of indices with probability proportional to their weights,
+    by bisection of the cumulative weights: O(log n) per draw,
+    with k draws at once from draw(k)
+    '''
+
+    def __init__(self,weights):
+        self.cdf=np.cumsum(weights,dtype=float)
+
+    def __len__(self):
+        return len(self.cdf)
+
+    def total(self):
+        return self.cdf[-1] if len(self) else 0.
+
+    def weight(self,i):
+        return self.cdf[i]-(self.cdf[i-1] if i else 0.)
+
+    def update(self,i,weight):
+        '''
+        Change the weight of index i, shifting the cumulative weights
+        after it, with zero weights added up to a new index i
+        '''
+        if i>=len(self):
+            self.cdf=np.append(self.cdf,np.repeat(self.total(),i+1-len(self)))
+        self.cdf[i:]+=weight-self.weight(i)
+
+    def draw(self,k=None):
+        u=rng.random_sample(k)*self.cdf[-1]
+        return np.minimum(np.searchsorted(self.cdf,u,side='right'),len(self)-1)
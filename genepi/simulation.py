@@ -9,6 +9,9 @@ log = logging.getLogger(__name__)
 
 import genome as gn
 import population as pop
+import sampling
+import parallel
+from migration import MigrationMatrix
 import sys
 
 class Simulation:
@@ -20,6 +23,16 @@ class Simulation:
 
             self.sim_duration = 365*10    # days
             self.sim_tstep    = 21        # days
+            self.engine       = 'fixed'   # or 'gillespie' for next-reaction events
+
+            self.adaptive_tstep = False   # choose each timestep from transmission rates
+            self.min_tstep    = 1         # days
+            self.max_tstep    = 63        # days
+            self.report_tstep = 21        # days between reports of adaptive runs
+            self.transmission_budget = 100 # expected transmissions per adaptive timestep
+
+            self.seed_per_population = False # draw from a stream per population
+            self.n_workers    = 1         # processes stepping partitions of populations
 
             for k,v in kwargs.items():
                 try:
@@ -31,11 +44,19 @@ class Simulation:
 
     def __init__(self, **kwargs):
         self.params=self.Params(**kwargs)
+        if self.params.n_workers>1 and not self.params.seed_per_population:
+            log.info('Seeding per population for %d workers',self.params.n_workers)
+            self.params.seed_per_population=True
         random.seed(self.params.random_seed)
+        sampling.seed(self.params.random_seed)
         log.debug('Simulation: random seed = %d' % self.params.random_seed)
         self.day=0
         self.migrants=defaultdict(list)
-        self.cohort_migrants=defaultdict(int)
+        self.migration=None # MigrationMatrix of populations, built on first update
+        self.migration_infos={} # MigrationInfo of each population in the matrix
+        self.migration_rng=sampling.seeded(self.params.random_seed,'migration') \
+                           if self.params.seed_per_population else sampling.rng
+        self.exchange=None # parallel.Exchange with other workers, if any
         self.reports=[]
         self.listeners=defaultdict(list)
         self.events=PriorityQueue()
@@ -49,45 +70,137 @@ class Simulation:
             sys.exit("ImportError for demog_source: %s"%e)
         self.populations={ k:pop.Population(k,self,**v) \
                            for k,v in demog.items() }
+        self.migration_matrix()
 
     def run(self):
-        for t in range(self.params.sim_duration/self.params.sim_tstep):
-            self.update()
+        if self.params.n_workers>1:
+            parallel.run(self,self.params.n_workers)
+        else:
+            self.run_steps()
         for r in self.reports:
             r.write(self.params.working_dir)
         for ll in self.listeners.values():
             for l in ll:
                 l.write(self.params.working_dir)
 
-    def update(self):
-        dt=self.params.sim_tstep
+    def run_steps(self):
+        if self.params.adaptive_tstep:
+            while self.day<self.params.sim_duration:
+                self.update(self.next_tstep())
+        else:
+            for t in range(self.params.sim_duration/self.params.sim_tstep):
+                self.update()
+
+    def migration_matrix(self):
+        '''
+        The MigrationMatrix of all populations, rebuilt when populations
+        are added or removed or their migration rates are set,
+        e.g. by an event, but not in parallel workers, where the other
+        workers would not see the change
+        '''
+        if self.migration is None or self.migration_changed():
+            if self.exchange is not None:
+                raise Exception('Cannot change populations or migration rates in parallel workers.')
+            self.migration=MigrationMatrix.from_populations(self.populations)
+            self.migration_infos={id:p.migration_info for id,p in self.populations.items()}
+        return self.migration
+
+    def migration_changed(self):
+        '''
+        Whether populations or their migration_info differ from those
+        of the matrix, up to the populations stepped by other workers
+        '''
+        if self.exchange is None and len(self.populations)!=len(self.migration_infos):
+            return True
+        return any(self.migration_infos.get(id) is not p.migration_info
+                   for id,p in self.populations.items())
+
+    def stepped_populations(self):
+        '''
+        Populations stepped in this process, in migration matrix order
+        '''
+        return [self.populations[id] for id in self.migration_matrix().ids
+                if id in self.populations]
+
+    def next_tstep(self):
+        '''
+        Days expected to make transmission_budget transmissions at
+        the current rates, within min_tstep and max_tstep, but ending
+        no later than the next event, report or end of simulation
+        '''
+        params=self.params
+        rates={p.id:p.transmission_rate() for p in self.stepped_populations()}
+        if self.exchange is not None:
+            rates=self.exchange.rates(rates)
+        rate=sum(rates[id] for id in self.migration_matrix().ids)
+        dt=params.transmission_budget/rate if rate>0 else params.max_tstep
+        dt=int(min(max(dt,params.min_tstep),params.max_tstep))
+        stops=[(self.day//params.report_tstep+1)*params.report_tstep,params.sim_duration]
+        if not self.events.empty():
+            stops.append(self.events.queue[0][0])
+        dt=max(1,min([dt]+[s-self.day for s in stops if s>self.day]))
+        log.debug('Adaptive timestep: rate=%0.2f dt=%d',rate,dt)
+        return dt
+
+    def update(self,dt=None):
+        dt=dt or self.params.sim_tstep
         self.day+=dt
         log.info('\nt=%d'%self.day)
         while True:
             if self.events.empty() or self.events.queue[0][0] > self.day:
                 break
-            evt = self.events.get()[1]
-            log.info('Executing event.')
-            evt(self)
-        for p in self.populations.values():
-            p.update(dt)
-        self.resolve_migration()
-        for r in self.reports:
-            r.update()
-
-    def resolve_migration(self):
-        for dest,emigrant_and_src_list in self.migrants.items():
-            for (emigrant,src) in emigrant_and_src_list:
-                log.debug('Migrating to %s: infection %s from %s',
-                           dest,emigrant.infection,src)
-                self.populations[dest].receive_immigrant(emigrant,src)
-        self.migrants.clear()
-        for dest,n_emigrants in self.cohort_migrants.items():
-            self.populations[dest].susceptibles.n_humans+=n_emigrants
-        self.cohort_migrants.clear()
-
-    def add_event(self,day,event):
-        self.events.put((day,event))
+            _,evt,pid = self.events.get()
+            if pid is None:
+                log.info('Executing event.')
+                evt(self)
+            elif pid in self.populations:
+                log.info('Executing event in %s.',pid)
+                with sampling.stream(self.populations[pid].rng):
+                    evt(self)
+        for p in self.stepped_populations():
+            with sampling.stream(p.rng):
+                if self.params.engine=='gillespie':
+                    p.advance(dt)
+                else:
+                    p.update(dt)
+        self.resolve_migration(dt)
+        if not self.params.adaptive_tstep or not self.day%self.params.report_tstep:
+            for r in self.reports:
+                r.update()
+        gn.Genome.store.evict_unheld()
+        log.info('Genome store: %s', gn.Genome.store)
+
+    def resolve_migration(self,dt):
+        '''
+        Move infected emigrants to their destinations, in a batch
+        per destination ordered by source, and draw the cohort flows
+        between all populations within dt from the migration matrix.
+        With other workers, emigrants and cohort sizes are first
+        exchanged with them.
+        '''
+        matrix=self.migration_matrix()
+        migrants,self.migrants=self.migrants,defaultdict(list)
+        n_susceptible={p.id:p.susceptibles.n_humans for p in self.stepped_populations()}
+        if self.exchange is not None:
+            migrants,n_susceptible=self.exchange.migrate(migrants,n_susceptible)
+        for dest,emigrant_and_src_list in sorted(migrants.items()):
+            log.debug('Migrating %d infections to %s',len(emigrant_and_src_list),dest)
+            p=self.populations[dest]
+            with sampling.stream(p.rng):
+                p.receive_immigrants(sorted(emigrant_and_src_list,key=lambda m:matrix.index[m[1]]))
+        with sampling.stream(self.migration_rng):
+            net_flows=matrix.net_flows([n_susceptible[id] for id in matrix.ids],dt)
+        for id,n in zip(matrix.ids,net_flows.tolist()):
+            if id in self.populations:
+                self.populations[id].susceptibles.n_humans+=n
+
+    def add_event(self,day,event,population=None):
+        '''
+        Call event(simulation) on day. An event targeting the population
+        with the given id runs only in the worker stepping that population;
+        others run in every worker, on the populations it steps.
+        '''
+        self.events.put((day,event,population))
 
     def add_reports(self,*args):
         for report_class in args:
@@ -0,0 +1,253 @@
+import itertools
+
+import logging
+log = logging.getLogger(__name__)
+
+import numpy as np
+
+class ChromosomeStore:
+    '''
+    Interned chromosome alleles: each distinct chromosome is stored once,
+    as a read-only array over its bytes, under a chromosome id.
+    Chromosomes are reference-counted by the stored genomes containing them.
+    '''
+
+    def __init__(self):
+        self.bytes_to_id = {}
+        self.id_to_bytes = {}
+        self.chromosomes = {} # read-only allele arrays by id
+        self.refcounts   = {} # stored genomes by id
+        self.ids         = itertools.count()
+
+    def __len__(self):
+        return len(self.chromosomes)
+
+    def intern(self,alleles):
+        s=alleles.tostring()
+        id=self.bytes_to_id.get(s,None)
+        if id is None:
+            id=self.ids.next()
+            self.bytes_to_id[s]=id
+            self.id_to_bytes[id]=s
+            self.chromosomes[id]=np.frombuffer(s,dtype=alleles.dtype)
+            self.refcounts[id]=0
+        return id
+
+    def get(self,chrom_ids):
+        return tuple(self.chromosomes[id] for id in chrom_ids)
+
+    def acquire(self,chrom_ids,chromosomes):
+        for id,c in zip(chrom_ids,chromosomes):
+            if id not in self.chromosomes:
+                log.debug('Restoring evicted chromosome id=%d',id)
+                s=c.tostring()
+                self.bytes_to_id.setdefault(s,id)
+                self.id_to_bytes[id]=s
+                self.chromosomes[id]=c
+                self.refcounts[id]=0
+            self.refcounts[id]+=1
+
+    def release(self,chrom_ids):
+        for id in chrom_ids:
+            self.refcounts[id]-=1
+            if not self.refcounts[id]:
+                del self.chromosomes[id]
+                del self.refcounts[id]
+                s=self.id_to_bytes.pop(id)
+                if self.bytes_to_id.get(s)==id:
+                    del self.bytes_to_id[s]
+
+class FounderStore:
+    '''
+    Non-reference alleles of founder genomes, as sorted arrays of genome
+    bins and alleles by founder id. Tract genomes resolve their alleles
+    from these, so founders are kept for the whole simulation.
+    '''
+
+    def __init__(self):
+        self.key_to_id = {}
+        self.variants  = [] # (bins,alleles) by founder id
+
+    def __len__(self):
+        return len(self.variants)
+
+    def intern(self,bins,alleles):
+        key=(bins.tostring(),alleles.tostring())
+        id=self.key_to_id.get(key,None)
+        if id is None:
+            id=len(self.variants)
+            self.key_to_id[key]=id
+            self.variants.append((bins,alleles))
+        return id
+
+    def alleles(self,id,bins):
+        vbins,valleles=self.variants[id]
+        idxs=np.searchsorted(vbins,bins)
+        hits=np.zeros(len(idxs),dtype=bool)
+        inside=idxs<len(vbins)
+        hits[inside]=(vbins[idxs[inside]]==bins[inside])
+        alleles=np.zeros(len(idxs),dtype=np.uint8)
+        alleles[hits]=valleles[idxs[hits]]
+        return alleles
+
+    def variants_between(self,id,start,end):
+        vbins,valleles=self.variants[id]
+        i,j=np.searchsorted(vbins,[start,end])
+        return vbins[i:j],valleles[i:j]
+
+class GenomeStore:
+    '''
+    Content-addressed map of genome hash to Genome.id and Genome,
+    reference-counted by the infections holding each genome.
+
+    Genomes are reported on 'genome.init' as soon as they are added.
+    Genomes added or released by their last holder and not held
+    are evicted by evict_unheld, e.g. at the end of a simulation step
+    once transmissions have acquired theirs, so that genomes built ahead
+    of an event or meiotic products never merged are not kept either.
+    A genome that arises again after eviction is stored (and reported)
+    under a new id, while an evicted Genome acquired again is replaced by
+    an equal stored genome or, if there is none, restored under its id.
+
+    Genomes are keyed by Genome.key(); the chromosomes of interned
+    genomes are kept in the ChromosomeStore while any stored genome
+    contains them, and tract genomes refer to the FounderStore.
+
+    Genome fitness is kept by id once looked up, while the genome
+    is stored, for lookup over all the genomes of an infection at once.
+    '''
+
+    def __init__(self):
+        self.hash_to_ids  = {} # ids by key, colliding keys sharing a list
+        self.id_to_hash   = {}
+        self.genomes      = {} # canonical Genome by id
+        self.refcounts    = {} # live holders by id
+        self.unreferenced = set() # ids added but not (or no longer) held
+        self.unheld       = set() # ids added or released since evict_unheld
+        self.n_total      = 0
+        self.n_evicted    = 0
+        self.chromosomes  = ChromosomeStore()
+        self.founders     = FounderStore()
+        self.fitness_by_id = {} # looked-up genome fitness by id
+
+    def __str__(self):
+        s  = 'live=%d '    % self.n_live()
+        s += 'stored=%d '  % len(self.genomes)
+        s += 'total=%d '   % self.n_total
+        s += 'evicted=%d ' % self.n_evicted
+        if self.chromosomes:
+            s += 'chromosomes=%d ' % len(self.chromosomes)
+        if self.founders:
+            s += 'founders=%d ' % len(self.founders)
+        return s
+
+    def get(self,h,genome=None):
+        '''
+        The stored genome under key h, with alleles equal to genome if given
+        '''
+        for id in self.hash_to_ids.get(h,[]):
+            stored=self.genomes[id]
+            if genome is None or stored.same_alleles(genome):
+                return stored
+            log.warning('Genome key collision with id=%d',id)
+        return None
+
+    def add(self,h,genome):
+        self.insert(h,genome)
+        self.n_total+=1
+
+    def insert(self,h,genome):
+        self.hash_to_ids.setdefault(h,[]).append(genome.id)
+        self.id_to_hash[genome.id]=h
+        self.genomes[genome.id]=genome
+        self.refcounts[genome.id]=0
+        if genome.chromosomes is not None:
+            self.chromosomes.acquire(genome.genome,genome.chromosomes)
+        self.unreferenced.add(genome.id)
+        self.unheld.add(genome.id)
+
+    def canonical(self,genomes):
+        '''
+        The stored genome for each of genomes: an evicted genome is
+        replaced by an equal genome stored since, or else restored
+        '''
+        canonical=[]
+        for g in genomes:
+            if g.id not in self.genomes:
+                h=g.key()
+                stored=self.get(h,g)
+                if stored is not None:
+                    log.debug('Replacing evicted genome id=%d by id=%d',g.id,stored.id)
+                    g=stored
+                else:
+                    log.debug('Restoring evicted genome id=%d',g.id)
+                    self.insert(h,g)
+                    self.n_evicted-=1
+            canonical.append(g)
+        return canonical
+
+    def acquire(self,genomes):
+        '''
+        Hold the stored genome for each of genomes, returning them
+        '''
+        genomes=self.canonical(genomes)
+        for g in genomes:
+            self.refcounts[g.id]+=1
+            self.unreferenced.discard(g.id)
+        return genomes
+
+    def release(self,genomes):
+        for g in genomes:
+            self.refcounts[g.id]-=1
+            if not self.refcounts[g.id]:
+                self.unreferenced.add(g.id)
+                self.unheld.add(g.id)
+
+    def evict(self,id):
+        h=self.id_to_hash.pop(id)
+        ids=self.hash_to_ids[h]
+        ids.remove(id)
+        if not ids:
+            del self.hash_to_ids[h]
+        genome=self.genomes.pop(id)
+        if genome.chromosomes is not None:
+            self.chromosomes.release(genome.genome)
+        del self.refcounts[id]
+        self.fitness_by_id.pop(id,None)
+        self.unreferenced.discard(id)
+        self.n_evicted+=1
+
+    def clear_fitness(self):
+        '''
+        Forget looked-up fitness, e.g. after add_locus
+        '''
+        self.fitness_by_id.clear()
+
+    def fitness(self,genomes):
+        '''
+        Array of the fitness of genomes, looked up by genome id
+        and computed only for genomes not looked up before
+        '''
+        fitness=np.empty(len(genomes))
+        for i,g in enumerate(genomes):
+            f=self.fitness_by_id.get(g.id)
+            if f is None:
+                f=self.fitness_by_id[g.id]=g.fitness()
+            fitness[i]=f
+        return fitness
+
+    def evict_unheld(self):
+        '''
+        Evict the genomes added or released by their last holder
+        since the last call and not acquired since
+        '''
+        for id in self.unheld:
+            if not self.refcounts.get(id,1):
+                self.evict(id)
+        self.unheld.clear()
+
+    def n_live(self):
+        return len(self.genomes)-len(self.unreferenced)
+
+    def counts(self):
+        return {'live':self.n_live(),'total':self.n_total,'evicted':self.n_evicted}
@@ -0,0 +1,170 @@
+import heapq
+
+import logging
+log = logging.getLogger(__name__)
+
+import numpy as np
+
+import genome as gn
+import infection as inf
+import sampling
+
+class InfectionTable:
+    '''
+    Struct-of-arrays state of the infected individuals of a population,
+    one row per individual, so that a timestep of infectiousness and
+    transmission counts is a few whole-array operations.
+
+    While an individual is in the table, its row holds the days on which
+    its infection started and clears, the mean fitness and number of
+    its strains, and the day on which it migrates; they are written back
+    to the Infection and Migration when it is removed. Rows are kept dense
+    by moving the last row into the place of a removed one.
+
+    Clearance and migration days are also queued by day, so that a step
+    only visits the individuals with an event due. Queued days that
+    no longer match the row, e.g. after a superinfection resets the
+    infection timers, are discarded when they come due.
+    '''
+
+    columns=['start','clearance','fitness','n_strains','migration']
+
+    def __init__(self,capacity=64):
+        self.day         = 0  # advanced by step or advance
+        self.individuals = [] # HumanIndividual by row
+        self.rows        = {} # row by HumanIndividual.id
+        self.queues      = {'clearance':[],'migration':[]} # (day,id) heaps
+        for c in self.columns:
+            setattr(self,c,np.zeros(capacity))
+
+    def __len__(self):
+        return len(self.individuals)
+
+    def column(self,name):
+        return getattr(self,name)[:len(self)]
+
+    def ages(self):
+        return self.day-self.column('start')
+
+    def add(self,individual):
+        self.extend([individual])
+
+    def extend(self,individuals):
+        '''
+        Add a row for each of individuals, e.g. a batch of immigrants,
+        looking up the fitness of all their strains at once
+        '''
+        start=len(self)
+        end=start+len(individuals)
+        if end>len(self.start):
+            for c in self.columns:
+                setattr(self,c,np.resize(getattr(self,c),max(2*len(self.start),end)))
+        for row,individual in enumerate(individuals,start):
+            self.individuals.append(individual)
+            self.rows[individual.id]=row
+            individual.infection.table=self
+            in_days=individual.migration.in_days
+            self.set_day(row,'migration',self.day+in_days if in_days else np.inf)
+            self.update_timers(individual.infection)
+        genomes=[i.infection.genomes for i in individuals]
+        n_strains=np.array([len(g) for g in genomes],dtype=int)
+        fitness=gn.Genome.store.fitness([g for gg in genomes for g in gg])
+        total=np.bincount(np.repeat(np.arange(len(genomes)),n_strains),
+                          weights=fitness,minlength=len(genomes))
+        self.fitness[start:end]=total/np.maximum(n_strains,1)
+        self.n_strains[start:end]=n_strains
+
+    def remove(self,individual):
+        row=self.rows.pop(individual.id)
+        infection=individual.infection
+        infection.table=None
+        infection.set_infection_state(self.clearance[row]-self.day,self.day-self.start[row])
+        if np.isfinite(self.migration[row]):
+            individual.migration.in_days=self.migration[row]-self.day
+        last=len(self)-1
+        moved=self.individuals.pop()
+        if row!=last:
+            self.individuals[row]=moved
+            self.rows[moved.id]=row
+            for c in self.columns:
+                a=getattr(self,c)
+                a[row]=a[last]
+
+    def set_day(self,row,name,day):
+        getattr(self,name)[row]=day
+        if np.isfinite(day):
+            heapq.heappush(self.queues[name],(day,self.individuals[row].id))
+
+    def update_timers(self,infection):
+        row=self.rows[infection.parent.id]
+        self.start[row]=self.day-infection.age
+        self.set_day(row,'clearance',self.day+infection.infection_timer)
+
+    def update_strains(self,infection):
+        row=self.rows[infection.parent.id]
+        self.fitness[row]=np.mean(infection.fitness()) if infection.genomes else 0
+        self.n_strains[row]=infection.n_strains()
+
+    def queued(self,name,day,id):
+        row=self.rows.get(id,None)
+        return row is not None and getattr(self,name)[row]==day
+
+    def due(self,name):
+        '''
+        Rows whose clearance or migration day has come
+        '''
+        rows=set()
+        queue=self.queues[name]
+        while queue and queue[0][0]<=self.day:
+            day,id=heapq.heappop(queue)
+            if self.queued(name,day,id):
+                rows.add(self.rows[id])
+        return sorted(rows)
+
+    def next_day(self):
+        '''
+        The earliest queued clearance or migration day,
+        or end of incubation after this day
+        '''
+        days=[np.inf]
+        for name,queue in self.queues.items():
+            while queue and not self.queued(name,*queue[0]):
+                heapq.heappop(queue)
+            if queue:
+                days.append(queue[0][0])
+        incubated=self.column('start')+inf.incubation
+        incubated=incubated[incubated>self.day]
+        if len(incubated):
+            days.append(incubated.min())
+        return min(days)
+
+    def advance(self,day):
+        '''
+        Advance to day, returning the rows whose infection
+        has cleared or, if not, whose individual migrates
+        '''
+        self.day=day
+        expired=self.due('clearance')
+        migrating=sorted(set(self.due('migration'))-set(expired))
+        return expired,migrating
+
+    def transmit_rates(self,vectorial_capacity,rows=None):
+        '''
+        Mean transmission rate of each infection, or of those in rows, on this day
+        '''
+        if rows is None:
+            rows=slice(0,len(self))
+        return vectorial_capacity*inf.mean_infectiousness(self.day-self.start[rows])*self.fitness[rows]
+
+    def step(self,dt,vectorial_capacity):
+        '''
+        Advance every infection by dt, returning the number of
+        transmissions from each row and the rows whose infection
+        has cleared or, if not, whose individual migrates
+        '''
+        expired,migrating=self.advance(self.day+dt)
+        transmit_rate=vectorial_capacity*dt*inf.infectiousness(self.ages())*self.column('fitness')
+        n_transmit=sampling.poisson(transmit_rate)
+        log.debug('%d infections: transmissions=%d expired=%d migrating=%d',
+                  len(self),n_transmit.sum(),len(expired),len(migrating))
+        return n_transmit,expired,migrating
@@ -130,10 +130,21 @@ def display_bit(b):
 obligate_co_scale_fn = np.poly1d(np.array([  2.86063522e-05,  -1.28111927e-03,   2.42373279e-02,
                                             -2.52092360e-01,   1.57111461e+00,  -5.99256708e+00,
                                              1.36678013e+01,  -1.72133175e+01,   9.61531678e+00]))
+obligate_co_scales = {} # obligate_co_scale_fn by gamma shape v
+
+def obligate_co_scale(v):
+    if v not in obligate_co_scales:
+        obligate_co_scales[v] = obligate_co_scale_fn(v)
+    return obligate_co_scales[v]
+
+def map_distance_to_bp(interarrival_times):
+    '''conversion of map distances (in Morgan) to bp, rounded up'''
+    return np.ceil(np.asarray(interarrival_times) * bp_per_cM* 100).astype(int)
                                  
 def gamma_interarrival_time(v=1):   #v=1 means no interference
     '''returns the distance in map units of the next chiasma event in the 4 chromatid bundle
-    interrarival times specify the next event (in Morgan)'''
+    interrarival times specify the next event (in Morgan)
+    kept only for the scalar reference samplers below, see renewal_points'''
     interarrival_time = np.random.gamma(shape=v, scale =1./(2*v))
     #rate parameter must be constrained to equal 2*shape
     #scale = 1/shape
@@ -144,25 +155,27 @@ def gamma_interarrival_time(v=1):   #v=1 means no interference
     return d
                                  
 def get_crossover_points(v,chrom_length):
-	'''not ever used, generates chiasma locations on 4-chromatid bundle'''
-	next_point=-100000 #make it a stationary renewal process
-	xpoints=[]
-	while next_point < chrom_length:
-		if next_point > 0.:
-			xpoints.append(next_point)
+    '''generates chiasma locations on 4-chromatid bundle
+    kept only as the test reference for batch_get_crossover_points'''
+    next_point=-100000 #make it a stationary renewal process
+    xpoints=[]
+    while next_point < chrom_length:
+        if next_point > 0.:
+            xpoints.append(next_point)
         d = gamma_interarrival_time(v)
         next_point+=d
-        return xpoints
+    return xpoints
 
 def oc_get_crossover_points(v, chrom_length):
     '''obligate chiasma version
     Generate the first obligate chiasma by drawing from a Uniform Distribution
-    Expand outwards from that point until you reach both ends of the chromosome'''
+    Expand outwards from that point until you reach both ends of the chromosome
+    kept only as the test reference for batch_oc_crossover_points'''
     xpoints=[]
     obligate_chiasma_pos = int(math.ceil(np.random.uniform(low=0., high= float(chrom_length))))
     xpoints.append(obligate_chiasma_pos)
     
-    scale = obligate_co_scale_fn(v)
+    scale = obligate_co_scale(v)
     #move to the right
     interarrival_time = np.random.gamma(shape=v, scale =scale)
     d = int(math.ceil(interarrival_time * bp_per_cM* 100))
@@ -181,59 +194,102 @@ def oc_get_crossover_points(v, chrom_length):
         
     return xpoints
 
+def renewal_points(first_points,limits,v):
+    '''
+    Gamma-renewal points from each first_points[i], at cumulative
+    gamma_interarrival_time distances, while below limits[i]:
+    a list of point lists, drawing blocks of interarrival times
+    for all rows at once until every row has passed its limit
+    '''
+    first_points=np.asarray(first_points,dtype=np.int64)
+    limits=np.asarray(limits,dtype=np.int64)
+    if not len(limits):
+        return []
+    mean_gap=bp_per_cM*100/2.
+    block=1+int(math.ceil(max(0,np.max(limits-first_points))/mean_gap))
+    points=[first_points[:,None]]
+    while np.any(points[-1][:,-1] < limits):
+        gaps=map_distance_to_bp(np.random.gamma(shape=v, scale=1./(2*v), size=(len(limits),block)))
+        points.append(points[-1][:,-1:]+np.cumsum(gaps,axis=1))
+    points=np.hstack(points)
+    counts=np.sum(points < limits[:,None],axis=1) # rows are increasing
+    return [p[:n] for p,n in zip(points.tolist(),counts.tolist())]
+
+def batch_get_crossover_points(v,chrom_lengths,n_meioses=1):
+    '''batched get_crossover_points for every chromosome of n_meioses meioses:
+    a list of per-chromosome xpoints for each meiosis'''
+    lengths=np.tile(chrom_lengths,n_meioses)
+    first=-100000+map_distance_to_bp(np.random.gamma(shape=v, scale=1./(2*v), size=len(lengths)))
+    xpoints=[[x for x in p if x > 0] for p in renewal_points(first,lengths,v)]
+    C=len(chrom_lengths)
+    return [xpoints[m*C:(m+1)*C] for m in range(n_meioses)]
+
+def batch_oc_crossover_points(v,chrom_lengths,n_meioses=1):
+    '''batched oc_get_crossover_points for every chromosome of n_meioses meioses:
+    a list of per-chromosome xpoints for each meiosis, in the same order
+    (obligate chiasma, then moving right, then moving left)'''
+    lengths=np.tile(chrom_lengths,n_meioses)
+    obligate=np.ceil(np.random.uniform(low=0., high=lengths.astype(float))).astype(int)
+    d=map_distance_to_bp(np.random.gamma(shape=v, scale=obligate_co_scale(v), size=len(lengths)))
+    right=renewal_points(obligate+d,lengths,v)
+    left=renewal_points(d-obligate,np.zeros_like(lengths),v) # moving left on -x
+    xpoints=[[o]+r+[-x for x in l] for o,r,l in zip(obligate.tolist(),right,left)]
+    C=len(chrom_lengths)
+    return [xpoints[m*C:(m+1)*C] for m in range(n_meioses)]
+
+chromatid_pairs = [(0,2),(0,3),(1,2),(1,3)] # non-sister (c1,c3),(c1,c4),(c2,c3),(c2,c4)
+
 def crossover(g1,g2,xpoints):
-    #S phase, DNA duplication time
-    c1 = np.copy(g1)
-    c2 = np.copy(g1)
-    
-    c3 = np.copy(g2)
-    c4 = np.copy(g2)
+    '''
+    S phase duplicates g1 into c1,c2 and g2 into c3,c4, then each
+    breakpoint in turn exchanges the tails [breakpoint:] of a random
+    non-sister pair of chromatids.
+    The exchanges are accumulated as the chromatid of origin in each
+    slot for every segment between breakpoints, so that each output
+    chromatid is written once, from its parent's slice of each segment.
+    '''
     if not xpoints:
-        return c1,c2, c3,c4
-    
-    for breakpoint in xpoints:
-        probability = np.random.random()
-        if probability < 0.25: 
-            # c1 and c3
-            t = np.copy(c1[breakpoint:])
-            c1[breakpoint:] = c3[breakpoint:]
-            c3[breakpoint:] = t
-        elif probability >= 0.25 and probability < 0.5: 
-            #c1 and c4
-            t = np.copy(c1[breakpoint:])
-            c1[breakpoint:] = c4[breakpoint:]
-            c4[breakpoint:] = t
-        elif probability >= 0.5 and probability < 0.75: 
-            #c2 and c3
-            t = np.copy(c2[breakpoint:])
-            c2[breakpoint:] = c3[breakpoint:]
-            c3[breakpoint:] = t
-        elif probability >=0.75:
-            #c2 and c4
-            t = np.copy(c2[breakpoint:])
-            c2[breakpoint:] = c4[breakpoint:]
-            c4[breakpoint:] = t
-    return c1, c2, c3, c4
-
-def meiosis(in1,in2,N=4,v=2, oc=True):
+        return np.copy(g1),np.copy(g1),np.copy(g2),np.copy(g2)
+    n=len(g1)
+    xpoints=[min(max(x,0),n) for x in xpoints]
+    probabilities=np.random.random(len(xpoints)).tolist()
+
+    bounds=sorted(set([0,n]+xpoints))
+    slots=[[0,1,2,3] for _ in bounds[:-1]] # chromatid of origin in each slot by segment
+    for x,probability in zip(xpoints,probabilities):
+        i,j=chromatid_pairs[min(int(probability*4),3)]
+        for s in slots[bisect.bisect_left(bounds,x):]:
+            s[i],s[j]=s[j],s[i]
+
+    parents=(g1,g2)
+    segments=zip(bounds[:-1],bounds[1:])
+    return tuple(np.concatenate([parents[s[k]//2][l1:l2] for s,(l1,l2) in zip(slots,segments)])
+                 for k in range(4))
+
+def batch_crossover_points(n_meioses,v=2, oc=True):
+    '''per-chromosome xpoints of n_meioses meioses, see meiosis'''
+    chrom_lengths=np.diff(Genome.chrom_breaks)
+    if v == 0:
+        return [[[] for _ in chrom_lengths] for _ in range(n_meioses)]
+    if oc:
+        return batch_oc_crossover_points(v,chrom_lengths,n_meioses)
+    return batch_get_crossover_points(v,chrom_lengths,n_meioses)
+
+def meiosis(in1,in2,N=4,v=2, oc=True, chrom_xpoints=None):
     '''v defines the shape of the gamma distribution, it is required to have a non-zero shape parameter
     if v = 0, we assume user means no crossover model
     v =1 corresponds to no interference
-    obligate crossover means use the obligate crossover version'''
+    obligate crossover means use the obligate crossover version
+    chrom_xpoints are per-chromosome xpoints drawn by batch_crossover_points'''
     if N > 4:
         raise IndexError('Maximum of four distinct meiotic products to sample.')
     genomes=[reference_genome() for _ in range(4)]
     
-    if v != 0:
-        if oc:
-            crossover_fn = oc_get_crossover_points
-        else:
-            crossover_fn = get_crossover_points
-    else:
-        crossover_fn = lambda x,y: []
+    if chrom_xpoints is None:
+        chrom_xpoints = batch_crossover_points(1,v,oc)[0]
     for idx,(start,end) in enumerate(utils.pairwise(Genome.chrom_breaks)):
         c1,c2=in1.genome[start:end],in2.genome[start:end]
-        xpoints = crossover_fn(v, len(c1))
+        xpoints = chrom_xpoints[idx]
 
         #log.debug('Chr %d, xpoints=%s',chrom_names[idx],xpoints)
         c1, c2, c3, c4=crossover(c1,c2,xpoints)
@@ -248,13 +304,15 @@ def meiosis(in1,in2,N=4,v=2, oc=True):
 
 def distinct_sporozoites_from(gametocyte_pairs,n_products):
     transmitted_sporozoites=[]
+    n_meioses=sum(g1.id!=g2.id for g1,g2 in gametocyte_pairs)
+    batch_xpoints=iter(batch_crossover_points(n_meioses))
     for (g1,g2),N in zip(gametocyte_pairs,n_products):
         if g1.id==g2.id:
             #log.debug('Selfing of gametocytes (id=%d)\n%s',g1.id,g1)
             t=Transmission((g1.id,g2.id),g1)
             transmitted_sporozoites.append(t)
         else:
-            meiotic_products=meiosis(g1,g2,N)
+            meiotic_products=meiosis(g1,g2,N,chrom_xpoints=batch_xpoints.next())
             #log.debug('Meiosis: %s',[str(mp) for mp in meiotic_products])
             tt=[Transmission((g1.id,g2.id),g) for g in meiotic_products]
             transmitted_sporozoites.extend(tt)
@@ -0,0 +1,110 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+from scipy.stats import ks_2samp
+
+from test_utils import binom_interval
+
+# genepi_cotx_pop imports the snp package of genepi as a top-level package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'genepi'))
+import genepi_cotx_pop.genome as gn
+
+def tail_swap_crossover(g1,g2,xpoints):
+    '''
+    The copy-and-swap-tails implementation replaced by gn.crossover
+    '''
+    c1 = np.copy(g1)
+    c2 = np.copy(g1)
+    c3 = np.copy(g2)
+    c4 = np.copy(g2)
+    for breakpoint in xpoints:
+        probability = np.random.random()
+        if probability < 0.25:
+            c1[breakpoint:], c3[breakpoint:] = np.copy(c3[breakpoint:]), np.copy(c1[breakpoint:])
+        elif probability < 0.5:
+            c1[breakpoint:], c4[breakpoint:] = np.copy(c4[breakpoint:]), np.copy(c1[breakpoint:])
+        elif probability < 0.75:
+            c2[breakpoint:], c3[breakpoint:] = np.copy(c3[breakpoint:]), np.copy(c2[breakpoint:])
+        else:
+            c2[breakpoint:], c4[breakpoint:] = np.copy(c4[breakpoint:]), np.copy(c2[breakpoint:])
+    return c1, c2, c3, c4
+
+class TestCrossover(unittest.TestCase):
+
+    nSNP = 60
+    nRandom = 2000
+    confint = 0.9999
+
+    def setUp(self):
+        np.random.seed(12345)
+        self.g1 = np.zeros(self.nSNP, dtype=np.uint8)
+        self.g2 = np.ones(self.nSNP, dtype=np.uint8)
+
+    def test_matches_tail_swap(self):
+        for _ in range(200):
+            xpoints = np.random.randint(0, self.nSNP+1, size=np.random.randint(0, 6)).tolist()
+            state = np.random.get_state()
+            expected = tail_swap_crossover(self.g1, self.g2, xpoints)
+            np.random.set_state(state)
+            chromatids = gn.crossover(self.g1, self.g2, xpoints)
+            for c, e in zip(chromatids, expected):
+                self.assertListEqual(c.tolist(), e.tolist())
+
+    def test_chromatid_distribution(self):
+        xpoints = [30, 10, 50, 20]
+        segments = [0, 10, 20, 30, 50] # first position of each segment
+        samples = {}
+        for name, fn in [('reference', tail_swap_crossover), ('kernel', gn.crossover)]:
+            chromatids = np.array([fn(self.g1, self.g2, xpoints) for _ in range(self.nRandom)])
+            samples[name] = chromatids[:, :, segments]
+        reference, kernel = samples['reference'], samples['kernel']
+
+        # frequency of second-parent alleles by chromatid and segment
+        for k in range(4):
+            for s in range(len(segments)):
+                lower, upper = binom_interval(kernel[:, k, s].sum(), self.nRandom, self.confint)
+                self.assertTrue(lower <= reference[:, k, s].mean() <= upper)
+
+        # frequency of recombinant chromatids
+        recombinant = lambda a: np.any(a != a[:, :, :1], axis=2)
+        for k in range(4):
+            lower, upper = binom_interval(recombinant(kernel)[:, k].sum(), self.nRandom, self.confint)
+            self.assertTrue(lower <= recombinant(reference)[:, k].mean() <= upper)
+
+class TestCrossoverPoints(unittest.TestCase):
+
+    nRandom = 2000
+    pvalue = 1e-4
+    chrom_lengths = [int(0.643e6), int(3.3e6)]
+
+    def setUp(self):
+        np.random.seed(12345)
+
+    def assertSameDistribution(self, a, b):
+        self.assertGreater(ks_2samp(a, b).pvalue, self.pvalue)
+
+    def compare(self, reference_fn, batch_fn, v):
+        reference = [[reference_fn(v, l) for l in self.chrom_lengths] for _ in range(self.nRandom)]
+        batch = batch_fn(v, self.chrom_lengths, self.nRandom)
+        for c, l in enumerate(self.chrom_lengths):
+            r = [m[c] for m in reference]
+            b = [m[c] for m in batch]
+            self.assertSameDistribution([len(x) for x in r], [len(x) for x in b])
+            self.assertAlmostEqual(np.mean([len(x) for x in r]), np.mean([len(x) for x in b]),
+                                   delta=0.1*np.mean([len(x) for x in r]))
+            self.assertSameDistribution([p for x in r for p in x], [p for x in b for p in x])
+            self.assertSameDistribution([x[0] for x in r if x], [x[0] for x in b if x])
+            self.assertTrue(all(0 <= p <= l for x in b for p in x))
+
+    def test_obligate_crossover_points(self):
+        for v in (1, 2, 4):
+            self.compare(gn.oc_get_crossover_points, gn.batch_oc_crossover_points, v)
+
+    def test_crossover_points(self):
+        for v in (1, 2, 4):
+            self.compare(gn.get_crossover_points, gn.batch_get_crossover_points, v)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import genepi.population as pop
+from genepi.forcing import Forcing
+
+class TestForcing(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_function(self):
+        days = []
+        def fn(t):
+            days.append(t)
+            return 0.1*t
+        forcing = Forcing.from_function(fn)
+        self.assertEqual(len(forcing), 0)
+        self.assertAlmostEqual(forcing(5.5), 0.5)
+        self.assertEqual(len(forcing), 6)
+        self.assertAlmostEqual(forcing(20), 2.0)
+        self.assertAlmostEqual(forcing(3), 0.3)
+        self.assertListEqual(days, range(21))
+        self.assertListEqual(forcing.values[:len(forcing)].tolist(), [0.1*t for t in range(21)])
+
+    def test_files(self):
+        npy = os.path.join(self.tmpdir, 'forcing.npy')
+        np.save(npy, np.arange(5.))
+        self.assertListEqual(Forcing.from_file(npy).values.tolist(), [0, 1, 2, 3, 4])
+        self.assertRaises(Exception, Forcing.from_file(npy), 5)
+
+        csv = os.path.join(self.tmpdir, 'forcing.csv')
+        with open(csv, 'w') as f:
+            f.write('day,vectorial_capacity\n0,0.1\n4,0.5\n')
+        self.assertListEqual(np.round(Forcing.from_file(csv).values, 6).tolist(), [0.1, 0.2, 0.3, 0.4, 0.5])
+
+        with open(csv, 'w') as f:
+            f.write('day,vectorial_capacity\n3,0.2\n')
+        self.assertListEqual(Forcing.from_file(csv).values.tolist(), [0.2]*4)
+        with open(csv, 'w') as f:
+            f.write('vectorial_capacity\n0.1\n0.2\n')
+        self.assertListEqual(Forcing.from_file(csv).values.tolist(), [0.1, 0.2])
+
+    def test_population(self):
+        p = pop.Population('test', None, n_humans=10, vectorial_capacity_forcing=[0.1, 0.2])
+        self.assertEqual(p.forcing(1), 0.2)
+        p = pop.Population('test', None, n_humans=10, vectorial_capacity_fn=lambda t: 0.3)
+        self.assertEqual(p.forcing(100), 0.3)
+        p = pop.Population('test', None, n_humans=10, annual_cycle=lambda t: 0.5,
+                           r0_params={'r0': [1, 2], 'day': [0, 100]})
+        self.assertAlmostEqual(p.forcing(50), 0.75)
+
+if __name__ == '__main__':
+    unittest.main()
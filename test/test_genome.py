@@ -4,6 +4,8 @@ import unittest
 import numpy as np
 
 import genepi.genome as gn
+import genepi.sampling as sampling
+import genepi.event.drug as drug
 
 class TestGenome(unittest.TestCase):
 
@@ -28,6 +30,29 @@ class TestGenome(unittest.TestCase):
                                expect_trunc_expo,
                                delta = self.nSigma*expect_trunc_expo/math.sqrt(self.nRandom))
 
+    def test_batch_crossover_points(self):
+        n = 1000
+        offsets, xbins = gn.batch_crossover_points(n)
+        counts = np.diff(offsets).reshape(n, gn.num_chroms())
+        lengths = np.diff(gn.Genome.chrom_breaks)
+        for m in range(3):
+            for c, (start, end) in enumerate(zip(gn.Genome.chrom_breaks[:-1], gn.Genome.chrom_breaks[1:])):
+                i = m*gn.num_chroms() + c
+                x = xbins[offsets[i]:offsets[i+1]]
+                self.assertListEqual(x.tolist(), sorted(x.tolist()))
+                self.assertTrue(all((x > start) & (x < end)))
+        expected = (lengths - 1) * gn.Genome.bin_size_bp / gn.bp_per_morgan
+        for c in range(gn.num_chroms()):
+            self.assertAlmostEqual(counts[:, c].mean(), expected[c],
+                                   delta=self.nSigma*math.sqrt(expected[c]/n))
+
+        firstxpoints = [xbins[offsets[m*gn.num_chroms()]] for m in range(n) if counts[m, 0]]
+        lambd = gn.bp_per_morgan / gn.Genome.bin_size_bp
+        k = gn.Genome.chrom_breaks[1] / lambd
+        expect_trunc_expo = lambd * ((1 - (k + 1) * math.exp(-k)) / (1-math.exp(-k)))
+        self.assertAlmostEqual(np.mean(firstxpoints), expect_trunc_expo,
+                               delta = self.nSigma*expect_trunc_expo/math.sqrt(len(firstxpoints)))
+
     def test_meiosis(self):
         in1 = gn.Genome.from_reference()
         in2 = gn.Genome.from_barcode([1]*gn.num_SNPs())
@@ -38,6 +63,54 @@ class TestGenome(unittest.TestCase):
         self.assertListEqual(np.sum([g.barcode() for g in genomes], axis=0).tolist(), [2]*gn.num_SNPs())
         self.assertRaises(IndexError, gn.meiosis, in1, in2, N=5)
 
+    def test_batch_meiosis(self):
+        in1 = gn.Genome.from_reference()
+        in2 = gn.Genome.from_barcode([1]*gn.num_SNPs())
+        in3 = gn.Genome(np.ones(gn.genome_length(), dtype=np.uint8))
+        products = gn.batch_meiosis([(in1, in2), (in1, in3), (in3, in1)], n_products=[4, 4, 2])
+        self.assertListEqual([len(p) for p in products], [4, 4, 2])
+        self.assertListEqual(np.sum([g.barcode() for g in products[0]], axis=0).tolist(), [2]*gn.num_SNPs())
+        self.assertListEqual(np.sum([g.genome for g in products[1]], axis=0).tolist(), [2]*gn.genome_length())
+        self.assertRaises(IndexError, gn.batch_meiosis, [(in1, in2)], n_products=[5])
+
+    def test_chromosome_digests(self):
+        in1 = gn.Genome.from_reference()
+        in2 = gn.Genome.from_barcode([1]*gn.num_SNPs())
+        self.assertEqual(len(in1.key()), 20)
+        for g in gn.meiosis(in1, in2):
+            self.assertTupleEqual(g.chrom_digests, gn.chromosome_digests(gn.split_chromosomes(g.genome)))
+            self.assertEqual(g.key(), gn.Genome(g.genome.copy()).key())
+
+    def test_lazy_products(self):
+        in1 = gn.Genome.from_reference()
+        in2 = gn.Genome.from_barcode([1]*gn.num_SNPs())
+        products = gn.meiosis(in1, in2)
+        grandchildren = gn.meiosis(products[0], products[1])
+        for g in products + grandchildren:
+            g.barcode()
+            g.fitness()
+            self.assertNotIn('genome', g.__dict__)
+        g = grandchildren[0]
+        barcode = g.barcode()
+        self.assertEqual(len(g.genome), gn.genome_length())
+        self.assertIsNone(g.chromatids)
+        self.assertListEqual(g.genome[gn.Genome.SNP_sites].tolist(), barcode.tolist())
+
+    def test_crossover_masks(self):
+        start, end = gn.Genome.chrom_breaks[1:3]
+        xpoints = [[7], [3, 11]]
+        counts = np.zeros((2, gn.num_chroms()), dtype=int)
+        counts[:, 1] = [len(xx) for xx in xpoints]
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        xbins = np.array([start + x for xx in xpoints for x in xx])
+        M = gn.crossover_masks(2, offsets, xbins)
+        c1 = np.zeros(end-start, dtype=np.uint8)
+        c2 = np.ones(end-start, dtype=np.uint8)
+        for m, xx in enumerate(xpoints):
+            c3, c4 = gn.crossover(c1, c2, list(xx))
+            self.assertListEqual(M[m, start:end].tolist(), c3.tolist())
+            self.assertEqual(M[m, :start].sum() + M[m, end:].sum(), 0)
+
     def test_gametocyte_products(self):
         g1 = gn.Genome.from_reference()
         g2 = gn.Genome.from_barcode([1]*gn.num_SNPs())
@@ -62,10 +135,149 @@ class TestGenome(unittest.TestCase):
         self.assertListEqual(gn.distinct([g1,g2,g3]), [g1,g2,g3])
         self.assertListEqual(gn.distinct([g1,g1,g2]), [g1,g2])
 
+    def test_distinct_alleles(self):
+        alleles = np.array([[1,0,1], [0,0,0], [1,0,1], [0,1,0], [0,0,0]], dtype=np.uint8)
+        distinct, idxs = gn.distinct_alleles(alleles)
+        self.assertListEqual(distinct.tolist(), [[1,0,1], [0,0,0], [0,1,0]])
+        self.assertListEqual(idxs.tolist(), [0, 1, 0, 2, 1])
+
+    def test_from_barcodes(self):
+        n = gn.num_SNPs()
+        barcodes = [[1]*n, [0]*n, [1]*6 + [0]*(n-6), [1]*n]
+        genomes = gn.Genome.from_barcodes(barcodes)
+        self.assertListEqual([g.id for g in genomes],
+                             [gn.Genome.from_barcode(b).id for b in barcodes])
+        self.assertIs(genomes[0], genomes[3])
+        self.assertListEqual(gn.Genome.from_barcodes([]), [])
+
     def test_display(self):
         g3 = gn.Genome.from_barcode([1]*6 + [0]*(gn.num_SNPs()-6))
         self.assertEqual(g3.display_barcode(), '*'*6 + '-'*(gn.num_SNPs()-6))
 
+class TestBarcodeOnly(unittest.TestCase):
+
+    def setUp(self):
+        gn.initialize_from('barcode', bin_size=1000, barcode_only=True)
+
+    def test_sites(self):
+        self.assertEqual(gn.n_sites(), gn.num_SNPs())
+        g = gn.Genome.from_barcode([1]*6 + [0]*(gn.num_SNPs()-6))
+        self.assertEqual(len(g.genome), gn.num_SNPs())
+        self.assertEqual(g.display_barcode(), '*'*6 + '-'*(gn.num_SNPs()-6))
+        self.assertEqual(g.bin_alleles()[gn.Genome.SNP_bins].tolist(), g.barcode().tolist())
+        self.assertEqual(g.display_genome().count('*'), 6)
+
+    def test_crossover_masks(self):
+        n = 5
+        offsets, xbins = gn.batch_crossover_points(n)
+        M = gn.crossover_masks(n, offsets, xbins)
+        site_bins = gn.Genome.site_bins
+        gn.set_sites(barcode_only=False)
+        M_dense = gn.crossover_masks(n, offsets, xbins)
+        self.assertListEqual(M.tolist(), M_dense[:, site_bins].tolist())
+
+    def test_meiosis(self):
+        in1 = gn.Genome.from_reference()
+        in2 = gn.Genome.from_barcode([1]*gn.num_SNPs())
+        genomes = gn.meiosis(in1, in2)
+        self.assertListEqual(np.sum([g.barcode() for g in genomes], axis=0).tolist(), [2]*gn.num_SNPs())
+
+    def test_resistance(self):
+        chrom, pos = drug.resistant_sites['AM']
+        gn.add_locus(chrom, pos, 'Pf.%d.%d' % (chrom, pos), fitness=0.5)
+        mf = lambda g: drug.set_resistance(g, 'AM')
+        g1 = gn.Genome.from_reference()
+        g2 = gn.Genome(gn.reference_genome(), mod_fns=[mf])
+        self.assertFalse(drug.is_resistant(g1, 'AM'))
+        self.assertTrue(drug.is_resistant(g2, 'AM'))
+        self.assertEqual(g2.fitness(), 0.5)
+        self.assertEqual(g2.barcode()[-1], 1)
+
+class RepresentationTests(object):
+    '''
+    Tests common to every genome representation, initialized
+    from the set_sites keyword arguments of the test case
+    '''
+
+    representation = {}
+
+    def setUp(self):
+        gn.initialize_from('barcode', bin_size=1000, **self.representation)
+
+    def test_barcode(self):
+        g1 = gn.Genome.from_barcode([1]*6 + [0]*(gn.num_SNPs()-6))
+        g2 = gn.Genome.from_barcode([1]*6 + [0]*(gn.num_SNPs()-6))
+        self.assertEqual(g1.id, g2.id)
+        self.assertEqual(g1.display_barcode(), '*'*6 + '-'*(gn.num_SNPs()-6))
+        self.assertListEqual(g1.bin_alleles()[gn.Genome.SNP_bins].tolist(), g1.barcode().tolist())
+        self.assertEqual(gn.Genome.from_barcode(g1.barcode()).id, g1.id)
+
+    def check_meiosis(self, in1, in2, genomes):
+        pass
+
+    def test_meiosis(self):
+        in1 = gn.Genome.from_reference()
+        in2 = gn.Genome(np.ones(gn.genome_length(), dtype=np.uint8))
+        genomes = gn.meiosis(in1, in2)
+        self.assertTrue(all(np.sum([g.bin_alleles() for g in genomes], axis=0) == 2))
+        self.check_meiosis(in1, in2, genomes)
+
+    def test_meiosis_matches_unpacked(self):
+        barcodes = [np.random.random_sample(gn.num_SNPs()) < 0.5 for _ in range(2)]
+        products = []
+        for representation in (self.representation, {}):
+            gn.set_sites(**representation)
+            in1, in2 = [gn.Genome.from_barcode(b) for b in barcodes]
+            sampling.seed(1)
+            products.append(np.array([g.bin_alleles() for g in gn.meiosis(in1, in2)]))
+        self.assertTrue(np.array_equal(products[0], products[1]))
+
+class TestPacked(RepresentationTests, unittest.TestCase):
+
+    representation = {'packed': True}
+
+    def test_packing(self):
+        g = gn.Genome.from_barcode([1]*6 + [0]*(gn.num_SNPs()-6))
+        self.assertEqual(g.genome.dtype, np.uint64)
+        self.assertEqual(g.genome.nbytes, 8*gn.n_words())
+
+class TestInterned(RepresentationTests, unittest.TestCase):
+
+    representation = {'interned': True}
+
+    def test_interning(self):
+        g1 = gn.Genome.from_barcode([1]*6 + [0]*(gn.num_SNPs()-6))
+        self.assertEqual(len(g1.genome), gn.num_chroms())
+        ref = gn.Genome.from_reference()
+        mutated = np.searchsorted(gn.Genome.chrom_breaks, gn.Genome.SNP_bins[:6], side='right') - 1
+        self.assertEqual(len(set(ref.genome) & set(g1.genome)), gn.num_chroms() - len(set(mutated)))
+
+    def check_meiosis(self, in1, in2, genomes):
+        for c in range(gn.num_chroms()):
+            self.assertEqual(len(set(g.genome[c] for g in genomes) & {in1.genome[c], in2.genome[c]}), 2)
+
+class TestTracts(RepresentationTests, unittest.TestCase):
+
+    representation = {'tracts': True}
+
+    def test_founders(self):
+        g1 = gn.Genome.from_barcode([1]*6 + [0]*(gn.num_SNPs()-6))
+        self.assertEqual(len(g1.genome), 1)
+
+    def check_meiosis(self, in1, in2, genomes):
+        for g in genomes:
+            ibd = gn.ibd_segments(in2.genome, g.genome)
+            self.assertEqual(sum(e-s for c,s,e in ibd), g.bin_alleles().sum())
+
+    def test_ibd_segments(self):
+        tracts1 = ((0, 10, 0), (10, 30, 1))
+        tracts2 = ((0, 5, 0), (5, 25, 2), (25, 30, 1))
+        chrom_breaks = [0, 8, 20, 30]
+        self.assertListEqual(gn.ibd_segments(tracts1, tracts1, chrom_breaks),
+                             [(0, 0, 8), (1, 8, 20), (2, 20, 30)])
+        self.assertListEqual(gn.ibd_segments(tracts1, tracts2, chrom_breaks),
+                             [(0, 0, 5), (2, 25, 30)])
+
 class TestCrossover(unittest.TestCase):
 
     nSNP = 24
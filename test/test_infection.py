@@ -66,18 +66,39 @@ class TestInfectionTransmit(unittest.TestCase):
             self.assertTrue(1 <= len(products) <= n_ooc)
             self.assertTrue(1 <= sum(products) <= n_hep)
 
-    def generator_test(self):
-        G=inf.infectious_generator()
-        G.send(None)
+    def test_transmission_plan(self, n=500):
+        offsets, n_products = inf.plan_transmissions(n)
+        self.assertEqual(len(offsets), n+1)
+        self.assertEqual(offsets[-1], len(n_products))
+        products = [n_products[s:e] for s, e in zip(offsets[:-1], offsets[1:])]
+        self.assertTrue(all(1 <= p.sum() <= inf.max_transmit_strains for p in products))
+        self.assertTrue(np.all((1 <= n_products) & (n_products <= 4)))
+        offsets, n_products = inf.plan_transmissions(0)
+        self.assertListEqual(offsets.tolist(), [0])
+        self.assertEqual(len(n_products), 0)
+
+    def test_transmit_planned(self):
+        g1 = gn.Genome.from_reference()
+        g2 = gn.Genome.from_barcode([1]*gn.num_SNPs())
+        i = inf.Infection(None, [g1, g2])
+        transmissions = i.transmit_planned(np.array([0, 2, 3]), np.array([4, 1, 2]))
+        self.assertEqual(len(transmissions), 2)
+        for tt, n in zip(transmissions, [5, 2]):
+            self.assertTrue(1 <= len(tt) <= n)
+            self.assertEqual(len(tt), len(set(tx.genome.id for tx in tt)))
+            self.assertTrue(all(tx.parentInfection is i for tx in tt))
+        clonal = inf.Infection(None, [g1]).transmit_planned(np.array([0, 1, 3]), np.array([2, 1, 1]))
+        self.assertEqual([[tx.genome.id for tx in tt] for tt in clonal], [[g1.id], [g1.id]])
+
+    def infectiousness_test(self):
         dt=21 # less than one incubation period
-        for i in range(self.nRepeats):
-            G.send(dt)
-            n=next(G)
-            print(n)
-            if i==0:
-                self.assertEqual(n, 0) # still incubating after first dt
-            else:
-                self.assertGreater(n, 0)
+        ages=dt*np.arange(1, self.nRepeats+1)
+        p=inf.infectiousness(ages)
+        print(p)
+        self.assertEqual(p[0], 0) # still incubating after first dt
+        self.assertTrue(np.all(p[1:] > 0))
+        self.assertTrue(np.all(p <= 1))
+        self.assertEqual(inf.mean_infectiousness_by_day[50], inf.mean_infectiousness(50))
 
     def infection_duration_test(self):
         d = []
@@ -91,14 +112,14 @@ class TestInfectionTransmit(unittest.TestCase):
         g2 = gn.Genome.from_barcode([1]*gn.num_SNPs())
         i = inf.Infection(None, [g1, g2])
         t, dt = 0, 21
-        self.assertEqual(next(i.infectiousness), 0)
+        self.assertEqual(i.infectiousness(), 0)
         for _ in range(self.nRepeats):
             txs = i.update(dt, 1)
             for tx in txs:
                 nstrains = i.n_strains()
                 genomes = [g.genome for g in tx]
                 i.merge_infection(genomes)
-                self.assertGreater(next(i.infectiousness), 0) # reinitialized post-incubation
+                self.assertGreater(i.infectiousness(), 0) # reinitialized post-incubation
                 self.assertGreaterEqual(nstrains + len(genomes), i.n_strains())
                 self.assertEqual(i.n_strains(), len(set([g.display_barcode() for g in i.genomes])))
                 break # just one transmission per iteration in this test suite
@@ -106,6 +127,19 @@ class TestInfectionTransmit(unittest.TestCase):
             t += dt
         self.assertGreater(i.n_strains(), 2)
 
+    def test_merge_infection(self):
+        g1 = gn.Genome.from_reference()
+        g2 = gn.Genome.from_barcode([1]*gn.num_SNPs())
+        g3 = gn.Genome.from_barcode([1]*gn.num_SNPs())
+        i = inf.Infection(None, [g1])
+        refcount = gn.Genome.store.refcounts[g2.id]
+        i.merge_infection([g2, g1, g3])
+        self.assertListEqual([g.id for g in i.genomes], [g1.id, g2.id])
+        self.assertEqual(gn.Genome.store.refcounts[g2.id], refcount+1)
+        i.set_genomes([g2])
+        i.merge_infection([g1])
+        self.assertListEqual([g.id for g in i.genomes], [g2.id, g1.id])
+
     def test_gametocyte_sampling(self):
         fitcost = 0.2
 
@@ -113,17 +147,32 @@ class TestInfectionTransmit(unittest.TestCase):
         g1 = gn.Genome.from_reference()
         g2 = gn.Genome.from_barcode([1]*gn.num_SNPs())
         i = inf.Infection(None, [g1, g2])
-        w = i.gametocyte_strain_cdf()
-
-        self.assertListEqual(w, [1/(1+fitcost), 1.0])
+        self.assertListEqual(i.gametocyte_sampler().cdf.tolist(), [1.0, 1+fitcost])
 
         nSamples = 30
         confInt = 0.99
-        selected = [i.select_strain(w).id == g1.id for _ in range(nSamples)]
+        selected = i.gametocyte_sampler().draw(nSamples) == 0
         lower, upper = binom_interval(nSamples/(1+fitcost), nSamples, confInt)
         print(lower, upper, sum(selected))
         self.assertTrue(lower <= sum(selected)/float(nSamples) <= upper)
 
+        pairs = i.sample_gametocyte_pairs(nSamples)
+        self.assertEqual(len(pairs), nSamples)
+        selected = [g.id == g1.id for pair in pairs for g in pair]
+        lower, upper = binom_interval(2*nSamples/(1+fitcost), 2*nSamples, confInt)
+        self.assertTrue(lower <= sum(selected)/float(2*nSamples) <= upper)
+        self.assertIs(i.gametocyte_sampler(), i.gametocyte_sampler())
+        i.merge_infection([gn.Genome.from_barcode([1]*6 + [0]*(gn.num_SNPs()-6))])
+        self.assertEqual(len(i.gametocyte_sampler()), 3)
+
+    def test_gametocyte_sampler_fitness(self):
+        g1 = gn.Genome.from_reference()
+        g2 = gn.Genome.from_barcode([1]*gn.num_SNPs())
+        i = inf.Infection(None, [g1, g2])
+        self.assertListEqual(i.gametocyte_sampler().cdf.tolist(), [1.0, 2.0])
+        gn.add_locus(7, 100, 'TEST', fitness=0.5)
+        self.assertListEqual(i.gametocyte_sampler().cdf.tolist(), [1.0, 1.5])
+
 if __name__ == '__main__':
     plot_chokepoints_test()
     plt.show()
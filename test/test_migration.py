@@ -1,6 +1,8 @@
 import unittest
 from collections import Counter
 
+import numpy as np
+
 from test_utils import binom_interval
 import genepi.migration as mig
 import genepi.population as pop
@@ -26,6 +28,49 @@ class TestMigration(unittest.TestCase):
             print('%s: %f < %f < %f ?' % (d, lower, m/float(n_humans), upper))
             self.assertTrue(lower <= m/n_humans <= upper)
 
+    def migrants_in_timestep_test(self):
+        migrants = self.mig_info.migrants_in_timestep(100, 2)
+        self.assertListEqual(sorted(migrants.keys()), ['d1', 'd2'])
+        self.assertTrue(0 <= sum(migrants.values()) <= 100)
+        self.assertEqual(mig.MigrationInfo({}).migrants_in_timestep(100, 2), {})
+
+    def next_migrations_test(self):
+        migrations = self.mig_info.next_migrations(5)
+        self.assertEqual(len(migrations), 5)
+        for m in migrations:
+            self.assertIn(m.destination, self.rates)
+            self.assertGreater(m.in_days, 0)
+        self.assertEqual(mig.MigrationInfo({}).next_migrations(2)[0].in_days, [])
+
+class TestMigrationMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.rates = {'a': {'b':0.1, 'c':0.3}, 'b': {'a':0.2}, 'c': {}}
+        self.matrix = mig.MigrationMatrix(['a', 'b', 'c'], self.rates)
+
+    def rates_test(self):
+        self.assertEqual(len(self.matrix), 3)
+        self.assertListEqual(self.matrix.total_rates.tolist(), [0.4, 0.2, 0])
+        self.assertEqual(self.matrix.rates[0, 2], 0.3)
+        self.assertRaises(Exception, mig.MigrationMatrix, ['a'], {'a': {'z':0.1}})
+
+    def cohort_flows_test(self):
+        flows = self.matrix.cohort_flows([1000, 1000, 1000], 1).toarray()
+        self.assertEqual(flows[2].sum(), 0)
+        self.assertEqual(flows[1, 2], 0)
+        lower, upper = binom_interval(1000*(1-np.exp(-0.4)), 1000, 0.999)
+        self.assertTrue(lower <= flows[0].sum()/1000. <= upper)
+        net = self.matrix.net_flows([1000, 1000, 1000], 1)
+        self.assertEqual(net.sum(), 0)
+
+    def from_populations_test(self):
+        simulation = sim.Simulation()
+        simulation.populate_from_demographics('grid_node', L=3)
+        matrix = simulation.migration
+        self.assertEqual(len(matrix), 9)
+        self.assertEqual(matrix.rates.nnz, 4*3 + 4*5 + 8)
+        self.assertEqual(matrix.rates[matrix.index['Population #4'], matrix.index['Population #0']], 5e-4/8)
+
 class TestTwoNodeMigration(unittest.TestCase):
 
     migration_rate = 0.02
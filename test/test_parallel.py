@@ -0,0 +1,84 @@
+import unittest
+
+import numpy as np
+
+import genepi.genome as gn
+import genepi.parallel as parallel
+import genepi.population as pop
+import genepi.simulation as sim
+from genepi.report.report import PopulationInfectionReport
+from genepi.report.listener import GenomeReport
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        gn.initialize_from('barcode', bin_size=1e7)
+
+    def run_simulation(self, n_workers, events=[]):
+        simulation = sim.Simulation(sim_duration=21*6, n_workers=n_workers,
+                                    seed_per_population=True, working_dir='/tmp/test_parallel')
+        simulation.add_reports(PopulationInfectionReport)
+        simulation.add_listeners(GenomeReport)
+        simulation.populate_from_demographics('grid_node', L=2, M=0.05)
+        for event in events:
+            simulation.add_event(*event)
+        simulation.run()
+        return simulation
+
+    def test_partition(self):
+        ids = ['a', 'b', 'c', 'd', 'e']
+        self.assertListEqual(parallel.partition(ids, 2), [['a', 'b', 'c'], ['d', 'e']])
+        self.assertListEqual(parallel.partition(ids, 1), [ids])
+
+    def test_emigrant_exchange(self):
+        simulation = sim.Simulation()
+        population = pop.Population('test', simulation, n_humans=10)
+        g1 = gn.Genome.from_reference()
+        g2 = gn.Genome.from_barcode([1]*gn.num_SNPs())
+        infection = population.add_new_infection([g1, g2])
+        individual = population.remove_infected(infection.parent)
+        records, genomes = parallel.pack_emigrants({'dest': [(individual, 'test')]})
+        self.assertListEqual(sorted(genomes.keys()), sorted([g1.id, g2.id]))
+        self.assertEqual(infection.n_strains(), 0)
+        migrants = parallel.unpack_immigrants(records, genomes)
+        (immigrant, src), = migrants['dest']
+        self.assertIs(immigrant, individual)
+        self.assertEqual(src, 'test')
+        self.assertListEqual([g.id for g in immigrant.infection.genomes], [g1.id, g2.id])
+        self.assertTrue(np.array_equal(immigrant.infection.genomes[1].barcode(), g2.barcode()))
+
+    def test_worker_count(self):
+        reports = []
+        for n_workers in (1, 3):
+            simulation = self.run_simulation(n_workers)
+            self.assertEqual(simulation.day, 21*6)
+            data = simulation.reports[0].data
+            self.assertEqual(len(data['tsteps']), 6)
+            reports.append((data['n_humans'], data['f_infected']))
+            ids = simulation.listeners['genome.init'][0].ids
+            self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(reports[0], reports[1])
+
+    def test_events(self):
+        def immigration(s):
+            s.populations['Population #3'].susceptibles.n_humans += 1000
+        def births(s):
+            for p in s.populations.values():
+                p.susceptibles.n_humans += 10
+        events = [(40, immigration, 'Population #3'), (40, births)]
+        reports = []
+        for n_workers in (1, 2):
+            simulation = self.run_simulation(n_workers, events)
+            reports.append(simulation.reports[0].data['n_humans'])
+        self.assertEqual(reports[0], reports[1])
+        n_humans = reports[1]
+        self.assertEqual(sum(n[-1] for n in n_humans.values()), 4*500 + 1000 + 4*10)
+
+    def test_migration_changes(self):
+        def rates(s):
+            s.populations['Population #3'].set_migration_rates({'Population #0': 0.1})
+        self.run_simulation(1, [(40, rates, 'Population #3')])
+        self.assertRaises(Exception, self.run_simulation, 2, [(40, rates, 'Population #3')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+import numpy as np
+
+import genepi.sampling as sampling
+
+class TestSampling(unittest.TestCase):
+
+    def test_seed(self):
+        draws = []
+        for _ in range(2):
+            sampling.seed(8675309)
+            draws.append((sampling.poisson([0.5, 10, 1e3]).tolist(),
+                          sampling.binomial([5, 50, 5000], 0.3).tolist(),
+                          sampling.multinomial(100, [1, 2, 7]).tolist()))
+        self.assertEqual(draws[0], draws[1])
+
+    def test_streams(self):
+        draws = [sampling.seeded(1, key).random_sample(3).tolist() for key in ('a', 'b', 'a')]
+        self.assertEqual(draws[0], draws[2])
+        self.assertNotEqual(draws[0], draws[1])
+        rng = sampling.rng
+        with sampling.stream(sampling.seeded(1, 'a')):
+            self.assertEqual(sampling.random_sample(3).tolist(), draws[0])
+        self.assertIs(sampling.rng, rng)
+
+    def test_edges(self):
+        self.assertListEqual(sampling.poisson([0, -1]).tolist(), [0, 0])
+        self.assertListEqual(sampling.binomial([0, 10, 10], [0.5, 0, 1.5]).tolist(), [0, 0, 10])
+        self.assertEqual(sampling.multinomial(10, [0, 3]).tolist(), [0, 10])
+
+    def test_binomial_mean(self):
+        n, p, size = 1000, 0.3, 2000
+        draws = sampling.binomial(np.repeat(n, size), p)
+        self.assertAlmostEqual(draws.mean(), n*p, delta=5*np.sqrt(n*p*(1-p)/size))
+
+    def test_multinomial_rows(self):
+        indptr, weights = np.array([0, 3, 3, 5]), [1, 0, 3, 2, 2]
+        counts = sampling.multinomial_rows([4000, 0, 10], indptr, weights)
+        self.assertListEqual(np.add.reduceat(counts, [0, 3]).tolist(), [4000, 10])
+        self.assertEqual(counts[1], 0)
+        self.assertAlmostEqual(counts[2]/4000., 0.75, delta=0.05)
+
+    def test_weighted_sampler(self):
+        sampler = sampling.WeightedSampler([1, 0, 3])
+        self.assertEqual(len(sampler), 3)
+        self.assertIn(sampler.draw(), [0, 2])
+        counts = np.bincount(sampler.draw(4000), minlength=3)
+        self.assertEqual(counts[1], 0)
+        self.assertAlmostEqual(counts[2]/4000., 0.75, delta=0.05)
+
+    def test_weighted_sampler_update(self):
+        sampler = sampling.WeightedSampler([1, 0, 3])
+        sampler.update(2, 1)
+        sampler.update(1, 2)
+        self.assertEqual(sampler.total(), 4)
+        self.assertListEqual([sampler.weight(i) for i in range(3)], [1, 2, 1])
+        sampler.update(4, 4)
+        self.assertListEqual([sampler.weight(i) for i in range(5)], [1, 2, 1, 0, 4])
+        counts = np.bincount(sampler.draw(4000), minlength=5)
+        self.assertEqual(counts[3], 0)
+        self.assertAlmostEqual(counts[4]/4000., 0.5, delta=0.05)
+        self.assertEqual(sampling.WeightedSampler([]).total(), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+import genepi.genome as gn
+import genepi.population as pop
+import genepi.simulation as sim
+
+class DayReport:
+    def __init__(self, parent):
+        self.parent = parent
+        self.days = []
+    def update(self):
+        self.days.append(self.parent.day)
+    def write(self, working_directory):
+        pass
+
+class TestAdaptiveTimestep(unittest.TestCase):
+
+    def setUp(self):
+        gn.initialize_from('barcode', bin_size=1e7)
+        self.simulation = sim.Simulation(sim_duration=200, adaptive_tstep=True,
+                                         max_tstep=50, report_tstep=40)
+        self.simulation.add_reports(DayReport)
+        self.event_days = []
+        self.simulation.add_event(30, lambda s: self.event_days.append(s.day))
+
+    def run_simulation(self, annual_cycle, n_humans=1000):
+        population = pop.Population('test', self.simulation, n_humans=n_humans,
+                                    n_infections=20, annual_cycle=annual_cycle)
+        self.simulation.populations = {'test': population}
+        days = []
+        while self.simulation.day < self.simulation.params.sim_duration:
+            self.simulation.update(self.simulation.next_tstep())
+            days.append(self.simulation.day)
+        return days
+
+    def test_alignment(self):
+        days = self.run_simulation(lambda t: 0)
+        self.assertListEqual(days, [30, 40, 80, 120, 160, 200])
+        self.assertListEqual(self.event_days, [30])
+        self.assertListEqual(self.simulation.reports[0].days, [40, 80, 120, 160, 200])
+
+    def test_transmission_budget(self):
+        self.simulation.params.transmission_budget = 1
+        days = self.run_simulation(lambda t: 0.1, n_humans=50)
+        steps = [b - a for a, b in zip([0] + days, days)]
+        self.assertEqual(days[-1], 200)
+        self.assertEqual(min(steps), 1)
+        self.assertTrue(all(1 <= dt <= 50 for dt in steps))
+
+class TestMigrationMatrix(unittest.TestCase):
+
+    def setUp(self):
+        gn.initialize_from('barcode', bin_size=1e7)
+        self.simulation = sim.Simulation(sim_duration=100)
+        self.simulation.populations = {id: pop.Population(id, self.simulation, n_humans=100)
+                                       for id in ('a', 'b')}
+
+    def test_rate_changes(self):
+        simulation = self.simulation
+        simulation.update()
+        self.assertEqual(simulation.migration_matrix().rates.nnz, 0)
+        simulation.add_event(30, lambda s: s.populations['a'].set_migration_rates({'b': 0.5}))
+        simulation.update()
+        simulation.update()
+        matrix = simulation.migration_matrix()
+        self.assertListEqual(matrix.rates.toarray().tolist(), [[0, 0.5], [0, 0]])
+        self.assertLess(simulation.populations['a'].n_humans(), 100)
+        self.assertEqual(sum(p.n_humans() for p in simulation.populations.values()), 200)
+
+    def test_population_changes(self):
+        simulation = self.simulation
+        simulation.update()
+        simulation.populations['c'] = pop.Population('c', simulation, n_humans=100,
+                                                     migration_rates={'a': 0.1})
+        simulation.update()
+        self.assertListEqual(simulation.migration_matrix().ids, ['a', 'b', 'c'])
+        del simulation.populations['b']
+        simulation.update()
+        self.assertListEqual(simulation.migration_matrix().ids, ['a', 'c'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+
+import numpy as np
+
+import genepi.genome as gn
+import genepi.infection as inf
+import genepi.population as pop
+import genepi.simulation as sim
+from genepi.store import GenomeStore
+
+class TestGenomeStore(unittest.TestCase):
+
+    def setUp(self):
+        gn.initialize_from('barcode')
+        gn.Genome.store = GenomeStore()
+
+    def test_content_addressing(self):
+        g1 = gn.Genome.from_barcode([1]*gn.num_SNPs())
+        g2 = gn.Genome.from_barcode([1]*gn.num_SNPs())
+        self.assertEqual(g1.id, g2.id)
+        self.assertIs(g1.genome, g2.genome)
+        self.assertEqual(gn.Genome.store.counts(), {'live':0, 'total':1, 'evicted':0})
+
+    def test_reference_counting(self):
+        store = gn.Genome.store
+        g1 = gn.Genome.from_reference()
+        g2 = gn.Genome.from_barcode([1]*gn.num_SNPs())
+        i1 = inf.Infection(None, [g1, g2])
+        i2 = inf.Infection(None, [g2])
+        self.assertEqual(store.refcounts[g2.id], 2)
+        self.assertEqual(store.counts(), {'live':2, 'total':2, 'evicted':0})
+
+        i1.set_genomes([])
+        self.assertIn(g1.id, store.genomes) # until the end of the step
+        store.evict_unheld()
+        self.assertNotIn(g1.id, store.genomes)
+        self.assertIn(g2.id, store.genomes)
+        self.assertEqual(store.counts(), {'live':1, 'total':2, 'evicted':1})
+
+        i2.merge_infection([g1])
+        self.assertEqual(i2.n_strains(), 2)
+        self.assertEqual(store.refcounts[g1.id], 1)
+        self.assertEqual(store.counts(), {'live':2, 'total':2, 'evicted':0})
+
+    def test_evict_unheld(self):
+        store = gn.Genome.store
+        g1 = gn.Genome.from_reference()
+        i1 = inf.Infection(None, [g1]) # held before the end of the step
+        store.evict_unheld()
+        self.assertIn(g1.id, store.genomes)
+        i1.set_genomes([])
+        i1.set_genomes([g1]) # acquired again within the step
+        store.evict_unheld()
+        self.assertIn(g1.id, store.genomes)
+        i1.set_genomes([])
+        store.evict_unheld()
+        self.assertEqual(store.counts(), {'live':0, 'total':1, 'evicted':1})
+        g2 = gn.Genome.from_reference()
+        self.assertNotEqual(g1.id, g2.id)
+
+        i2 = inf.Infection(None, [g1])
+        self.assertIs(i2.genomes[0], g2)
+        self.assertListEqual(store.hash_to_ids[g2.key()], [g2.id])
+        self.assertEqual(store.counts(), {'live':1, 'total':2, 'evicted':1})
+
+    def test_evict_never_held(self):
+        store = gn.Genome.store
+        g1 = gn.Genome.from_reference()
+        store.evict_unheld()
+        self.assertNotIn(g1.id, store.genomes)
+        self.assertEqual(store.counts(), {'live':0, 'total':1, 'evicted':1})
+        i1 = inf.Infection(None, [g1]) # e.g. built ahead of an event
+        self.assertIs(i1.genomes[0], g1)
+        self.assertEqual(store.refcounts[g1.id], 1)
+        self.assertEqual(store.counts(), {'live':1, 'total':1, 'evicted':0})
+
+    def test_simulation_counts(self):
+        simulation = sim.Simulation(sim_duration=21*10)
+        simulation.populations = {'test': pop.Population('test', simulation, n_humans=200,
+                                                          n_infections=20, annual_cycle=lambda t: 0.3)}
+        simulation.run_steps()
+        counts = gn.Genome.store.counts()
+        self.assertGreater(counts['evicted'], 0)
+        self.assertEqual(counts['live'], counts['total']-counts['evicted'])
+        self.assertEqual(len(gn.Genome.store.genomes), counts['live']) # only held genomes kept
+
+    def test_key_collision(self):
+        key = gn.Genome.key
+        try:
+            gn.Genome.key = lambda self: 'collision'
+            g1 = gn.Genome.from_reference()
+            g2 = gn.Genome.from_barcode([1]*gn.num_SNPs())
+            g3 = gn.Genome.from_reference()
+        finally:
+            gn.Genome.key = key
+        self.assertNotEqual(g1.id, g2.id)
+        self.assertEqual(g1.id, g3.id)
+        gn.Genome.store.evict(g1.id)
+        self.assertIs(gn.Genome.store.get('collision', g2), g2)
+
+    def test_fitness_lookup(self):
+        store = gn.Genome.store
+        alleles = gn.reference_genome()
+        alleles[gn.site_from_bin(gn.snp_bin_from_chrom_pos(7, 100))] = 1
+        g1 = gn.Genome.from_reference()
+        g2 = gn.Genome(alleles)
+        self.assertListEqual(store.fitness([g1, g2, g1]).tolist(), [1.0, 1.0, 1.0])
+        gn.add_locus(7, 100, 'TEST', fitness=0.5)
+        self.assertEqual(g2.fitness(), 0.5)
+        self.assertListEqual(store.fitness([g1, g2, g1]).tolist(), [1.0, 0.5, 1.0])
+        self.assertListEqual(store.fitness([]).tolist(), [])
+        store.evict(g2.id)
+        self.assertDictEqual(store.fitness_by_id, {g1.id: 1.0})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+
+import numpy as np
+
+import genepi.genome as gn
+import genepi.population as pop
+import genepi.simulation as sim
+
+class TestInfectionTable(unittest.TestCase):
+
+    def setUp(self):
+        gn.initialize_from('barcode', bin_size=1e7)
+        self.population = pop.Population('test', None, n_humans=10)
+        self.table = self.population.infecteds
+        self.g1 = gn.Genome.from_reference()
+        self.g2 = gn.Genome.from_barcode([1]*gn.num_SNPs())
+
+    def test_rows(self):
+        infections = [self.population.add_new_infection(g) for g in
+                      ([self.g1], [self.g1, self.g2], [self.g2])]
+        self.assertEqual(len(self.table), 3)
+        self.assertListEqual(self.table.column('n_strains').tolist(), [1, 2, 1])
+        self.assertEqual(self.population.n_polygenomic(), 1)
+        self.assertEqual(self.population.coi_distribution(), {1:2, 2:1})
+        self.assertEqual(self.population.n_humans(), 10)
+
+        infections[0].merge_infection([self.g2])
+        self.assertListEqual(self.table.column('n_strains').tolist(), [2, 2, 1])
+        self.assertEqual(self.table.ages()[0], 25)
+
+        clearance = self.table.column('clearance')[2]
+        self.population.remove_infected(infections[0].parent)
+        self.assertEqual(len(self.table), 2)
+        self.assertEqual(self.table.rows[infections[2].parent.id], 0)
+        self.assertIs(self.table.individuals[0], infections[2].parent)
+        self.assertEqual(self.table.column('clearance')[0], clearance)
+        self.assertEqual(infections[0].table, None)
+
+    def test_step(self):
+        i1 = self.population.add_new_infection([self.g1])
+        i2 = self.population.add_new_infection([self.g2])
+        i1.expire()
+        timer = i2.infection_timer
+        n_transmit, expired, migrating = self.table.step(21, 0)
+        self.assertListEqual(n_transmit.tolist(), [0, 0])
+        self.assertListEqual(expired, [0, 1] if timer <= 21 else [0])
+        self.assertListEqual(migrating, [])
+        self.assertListEqual(self.table.ages().tolist(), [21, 21])
+
+        self.population.remove_infected(i2.parent)
+        self.assertEqual(i2.infection_timer, timer-21)
+        self.assertEqual(i2.age, 21)
+
+    def test_queues(self):
+        i1 = self.population.add_new_infection([self.g1])
+        i2 = self.population.add_new_infection([self.g2])
+        i1.set_infection_state(10, 0)
+        i1.set_infection_state(100, 0) # e.g. reset by superinfection
+        i2.set_infection_state(200, 0)
+        self.population.remove_infected(i2.parent)
+        i2.parent.migration.in_days = 30
+        self.population.add_infected(i2.parent)
+        n_transmit, expired, migrating = self.table.step(21, 0)
+        self.assertListEqual(expired, [])
+        self.assertListEqual(migrating, [])
+        n_transmit, expired, migrating = self.table.step(21, 0)
+        self.assertListEqual(expired, [])
+        self.assertListEqual(migrating, [1])
+
+    def test_advance(self):
+        simulation = sim.Simulation(engine='gillespie')
+        population = pop.Population('test', simulation, n_humans=10,
+                                    annual_cycle=lambda t: 0)
+        infections = [population.add_new_infection([g]) for g in (self.g1, self.g2)]
+        days = [i.infection_timer for i in infections]
+        population.advance(min(days))
+        self.assertEqual(population.n_infecteds(), 1)
+        self.assertEqual(population.infecteds.day, min(days))
+        population.advance(max(days) - min(days))
+        self.assertEqual(population.n_infecteds(), 0)
+        self.assertEqual(population.n_humans(), 10)
+
+        population = pop.Population('test', simulation, n_humans=100,
+                                    annual_cycle=lambda t: 1)
+        infection = population.add_new_infection([self.g1])
+        infection.set_infection_state(1000, 0)
+        population.advance(100)
+        self.assertGreater(population.n_infecteds(), 1)
+
+    def test_advance_transmission_days(self):
+        simulation = sim.Simulation(engine='gillespie')
+        days = []
+        class DayListener:
+            event = 'infection.transmit'
+            def __init__(self, parent):
+                pass
+            def notify(self, transmission):
+                days.extend(t.day for t in transmission)
+        simulation.add_listeners(DayListener)
+        population = pop.Population('test', simulation, n_humans=100,
+                                    annual_cycle=lambda t: 1)
+        infection = population.add_new_infection([self.g1])
+        infection.set_infection_state(1000, 0)
+        simulation.day = 100 # advanced by Simulation.update before stepping
+        population.advance(100)
+        self.assertGreater(len(days), 1)
+        self.assertTrue(all(0 < d < 100 for d in days))
+        self.assertLess(min(days), max(days))
+
+if __name__ == '__main__':
+    unittest.main()